@@ -463,6 +463,14 @@ def release_lock():
 	lock.release()
 
 
+def get_client_ports(client_name):
+	try:
+		return jclient.get_ports(client_name, is_physical=False)
+	except Exception as err:
+		logger.error("Can't get JACK ports for {} => {}".format(client_name, err))
+		return None
+
+
 def start(rt=2):
 	global refresh_time, exit_flag, jclient, thread, lock
 	refresh_time=rt
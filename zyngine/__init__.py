@@ -3,7 +3,16 @@ __all__ = [
 	"zynthian_zcmidi",
 	"zynthian_midi_filter",
 	"zynthian_controller",
+	"zynthian_preset_entry",
+	"zynthian_preset_search",
+	"zynthian_trace",
 	"zynthian_layer",
+	"zynthian_watchdog",
+	"zynthian_preset_prefetch",
+	"zynthian_preset_catalog",
+	"zynthian_snapshot_codec",
+	"zynthian_snapshot_writer",
+	"zynthian_snapshot_prewarm",
 	"zynthian_engine",
 	"zynthian_engine_zynaddsubfx",
 	"zynthian_engine_linuxsampler",
@@ -20,7 +29,16 @@ __all__ = [
 from zyngine.zynthian_zcmidi import *
 from zyngine.zynthian_midi_filter import *
 from zyngine.zynthian_controller import *
+from zyngine.zynthian_preset_entry import *
+from zyngine.zynthian_preset_search import *
+from zyngine.zynthian_trace import *
 from zyngine.zynthian_layer import *
+from zyngine.zynthian_watchdog import *
+from zyngine.zynthian_preset_prefetch import *
+from zyngine.zynthian_preset_catalog import *
+from zyngine.zynthian_snapshot_codec import *
+from zyngine.zynthian_snapshot_writer import *
+from zyngine.zynthian_snapshot_prewarm import *
 from zyngine.zynthian_engine import *
 from zyngine.zynthian_engine_zynaddsubfx import *
 from zyngine.zynthian_engine_linuxsampler import *
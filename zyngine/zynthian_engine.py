@@ -28,12 +28,15 @@ import copy
 import liblo
 import logging
 import pexpect
-from time import sleep
+from time import sleep, monotonic
+from threading import Condition
 from os.path import isfile, isdir, join
 from string import Template
 from collections import OrderedDict
 
 from . import zynthian_controller
+from . import zynthian_latency_histogram
+from . import get_preset_catalog
 
 #------------------------------------------------------------------------------
 # Synth Engine Base Class
@@ -80,6 +83,14 @@ class zynthian_engine:
 	# Config variables
 	# ---------------------------------------------------------------------------
 
+	# Time (seconds) for the engine to be ready after a preset change.
+	# Engines whose set_preset returns when loading is complete use 0.
+	preset_settle_time = 0.3
+
+	# Bank & preset can be restored from a worker thread (concurrent snapshot restore):
+	# no GUI access and MIDI output only through zynmidi, that is deferred to the calling thread.
+	concurrent_restore = False
+
 	# ---------------------------------------------------------------------------
 	# Initialization
 	# ---------------------------------------------------------------------------
@@ -93,7 +104,9 @@ class zynthian_engine:
 		self.jackname = ""
 
 		self.loading = 0
+		self.loading_cond = Condition()
 		self.layers = []
+		self.degraded = False
 
 		self.options = {
 			'clone': True,
@@ -109,12 +122,15 @@ class zynthian_engine:
 		self.command = None
 		self.command_env = None
 		self.command_prompt = None
+		self.proc_cmd_ts = None
+		self.ipc_latency = zynthian_latency_histogram()
 
 		self.osc_target = None
 		self.osc_target_port = None
 		self.osc_server = None
 		self.osc_server_port = None
 		self.osc_server_url = None
+		self.osc_latency = zynthian_latency_histogram()
 
 
 	def __del__(self):
@@ -122,7 +138,9 @@ class zynthian_engine:
 
 	def reset(self):
 		#Reset Vars
-		self.loading=0
+		with self.loading_cond:
+			self.loading=0
+			self.loading_cond.notify_all()
 		self.loading_snapshot=False
 		#TODO: OSC, IPC, ...
 
@@ -154,22 +172,32 @@ class zynthian_engine:
 	# ---------------------------------------------------------------------------
 
 	def start_loading(self):
-		self.loading=self.loading+1
-		if self.loading<1: self.loading=1
+		with self.loading_cond:
+			self.loading=self.loading+1
+			if self.loading<1: self.loading=1
 		if self.zyngui:
 			self.zyngui.start_loading()
 
 	def stop_loading(self):
-		self.loading=self.loading-1
-		if self.loading<0: self.loading=0
+		with self.loading_cond:
+			self.loading=self.loading-1
+			if self.loading<0: self.loading=0
+			self.loading_cond.notify_all()
 		if self.zyngui:
 			self.zyngui.stop_loading()
 
 	def reset_loading(self):
-		self.loading=0
+		with self.loading_cond:
+			self.loading=0
+			self.loading_cond.notify_all()
 		if self.zyngui:
 			self.zyngui.stop_loading()
 
+	# Wait until loading is finished. Returns False on timeout.
+	def wait_stop_loading(self, timeout=None):
+		with self.loading_cond:
+			return self.loading_cond.wait_for(lambda: self.loading<=0, timeout)
+
 	# ---------------------------------------------------------------------------
 	# Refresh Management
 	# ---------------------------------------------------------------------------
@@ -218,6 +246,12 @@ class zynthian_engine:
 			self.proc=None
 
 
+	# Restart the engine process. Engines keeping extra state should re-create it here.
+	def restart(self):
+		self.stop()
+		self.start()
+
+
 	def proc_get_output(self):
 		if self.command_prompt:
 			self.proc.expect(self.command_prompt)
@@ -231,12 +265,15 @@ class zynthian_engine:
 		if self.proc:
 			try:
 				#logging.debug("proc command: "+cmd)
+				self.proc_cmd_ts=monotonic()
 				self.proc.sendline(cmd)
 				out=self.proc_get_output()
+				self.ipc_latency.add(monotonic()-self.proc_cmd_ts)
 				logging.debug("proc output:\n{}".format(out))
 			except Exception as err:
 				out=""
 				logging.error("Can't exec engine command: {} => {}".format(cmd, err))
+			self.proc_cmd_ts=None
 			return out
 
 
@@ -274,6 +311,17 @@ class zynthian_engine:
 		self.osc_server.add_method(None, None, self.cb_osc_all)
 
 
+	# Send a list of messages (path, *args) as a single timestamped OSC bundle
+	def osc_send_bundle(self, msgs, timetag=None):
+		if msgs:
+			if timetag is None:
+				timetag=liblo.time()
+			bundle=liblo.Bundle(timetag)
+			for msg in msgs:
+				bundle.add(liblo.Message(*msg))
+			liblo.send(self.osc_target, bundle)
+
+
 	def cb_osc_all(self, path, args, types, src):
 		logging.info("OSC MESSAGE '%s' from '%s'" % (path, src.url))
 		for a, t in zip(args, types):
@@ -292,17 +340,19 @@ class zynthian_engine:
 		fext='.'+fext
 		xlen=len(fext)
 		i=0
+		catalog=get_preset_catalog()
 		for dpd in dpath:
 			dp=dpd[1]
 			dn=dpd[0]
 			try:
-				for f in sorted(os.listdir(dp)):
-					if not f.startswith('.') and isfile(join(dp,f)) and f[-xlen:].lower()==fext:
-						title=str.replace(f[:-xlen], '_', ' ')
-						if dn!='_': title=dn+'/'+title
-						#print("filelist => "+title)
-						res.append((join(dp,f),i,title,dn,f))
-						i=i+1
+				flist=catalog.get_or_scan('filelist', dp + "|" + fext, [dp],
+					lambda: [f for f in sorted(os.listdir(dp)) if not f.startswith('.') and isfile(join(dp,f)) and f[-xlen:].lower()==fext])
+				for f in flist:
+					title=str.replace(f[:-xlen], '_', ' ')
+					if dn!='_': title=dn+'/'+title
+					#print("filelist => "+title)
+					res.append((join(dp,f),i,title,dn,f))
+					i=i+1
 			except:
 				pass
 
@@ -314,18 +364,20 @@ class zynthian_engine:
 		res=[]
 		if isinstance(dpath, str): dpath=[('_', dpath)]
 		i=0
+		catalog=get_preset_catalog()
 		for dpd in dpath:
 			dp=dpd[1]
 			dn=dpd[0]
 			try:
-				for f in sorted(os.listdir(dp)):
-					if not f.startswith('.') and isdir(join(dp,f)):
-						title,ext=os.path.splitext(f)
-						title=str.replace(title, '_', ' ')
-						if dn!='_': title=dn+'/'+title
-						#print("dirlist => "+title)
-						res.append((join(dp,f),i,title,dn,f))
-						i=i+1
+				flist=catalog.get_or_scan('dirlist', dp, [dp],
+					lambda: [f for f in sorted(os.listdir(dp)) if not f.startswith('.') and isdir(join(dp,f))])
+				for f in flist:
+					title,ext=os.path.splitext(f)
+					title=str.replace(title, '_', ' ')
+					if dn!='_': title=dn+'/'+title
+					#print("dirlist => "+title)
+					res.append((join(dp,f),i,title,dn,f))
+					i=i+1
 			except:
 				pass
 
@@ -407,6 +459,19 @@ class zynthian_engine:
 		logging.info('Getting Preset List for %s: NOT IMPLEMENTED!' % self.name),'PD'
 
 
+	# Iterator yielding the bank's presets while they are found, for slow (i.e. not cached) preset lists.
+	# None if get_preset_list is fast enough.
+	def get_preset_list_iter(self, bank):
+		return None
+
+
+	# Yield (bank, preset_list) for every bank, without a running engine instance.
+	# Used for building the preset search index.
+	@classmethod
+	def get_preset_index_lists(cls):
+		return []
+
+
 	def set_preset(self, layer, preset, preload=False):
 		if isinstance(preset[1],int):
 			self.zyngui.zynmidi.set_midi_prg(layer.get_midi_chan(), preset[1])
@@ -425,6 +490,12 @@ class zynthian_engine:
 			return False
 
 
+	# Files read by the engine when loading a preset. Used for prefetching & snapshot prewarm.
+	@classmethod
+	def get_preset_files(cls, preset):
+		return []
+
+
 	# ---------------------------------------------------------------------------
 	# Controllers Management
 	# ---------------------------------------------------------------------------
@@ -23,7 +23,6 @@
 #******************************************************************************
 
 import logging
-import copy
 import struct
 from collections import OrderedDict
 
@@ -210,7 +209,7 @@ class zynthian_engine_aeolus(zynthian_engine):
 			if l!=layer:
 				l.bank_index=layer.bank_index
 				l.bank_name=layer.bank_name
-				l.bank_info=copy.deepcopy(layer.bank_info)
+				l.bank_info=layer.bank_info
 		return True
 
 	#----------------------------------------------------------------------------
@@ -225,7 +224,7 @@ class zynthian_engine_aeolus(zynthian_engine):
 			if gc['preset']>i and gc['bank']==bank[1]:
 				i=gc['preset']
 				title="Preset {0:02d}".format(i+1)
-				res.append((title,[0,bank[1],i],title,gc['gconf']))
+				res.append((title,(0,bank[1],i),title,tuple(gc['gconf'])))
 		return res
 
 
@@ -248,7 +247,7 @@ class zynthian_engine_aeolus(zynthian_engine):
 				if l!=layer:
 					l.preset_index=layer.preset_index
 					l.preset_name=layer.preset_name
-					l.preset_info=copy.deepcopy(layer.preset_info)
+					l.preset_info=layer.preset_info
 					l.preset_bank_index=l.bank_index
 					l.preload_index=l.preset_index
 					l.preload_name=l.preset_name
@@ -25,9 +25,45 @@
 import os
 import re
 import copy
+import mmap
+import struct
 import logging
 from . import zynthian_engine
 from . import zynthian_controller
+from . import get_preset_catalog
+
+#------------------------------------------------------------------------------
+# SoundFont 2 helper functions
+#------------------------------------------------------------------------------
+
+# Read preset headers (phdr chunk) from a SF2 file, without loading sample data.
+# Returns a list of [bank, program, name], sorted by bank & program.
+def sf2_read_presets(fpath):
+	presets=[]
+	with open(fpath, "rb") as fh:
+		with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+			if mm[0:4]!=b'RIFF' or mm[8:12]!=b'sfbk':
+				raise ValueError("Not a SoundFont 2 file")
+			end=min(len(mm), 8+struct.unpack_from("<I", mm, 4)[0])
+			pos=12
+			# Look for LIST/pdta, skipping sample data (sdta)
+			while pos+12<=end:
+				ckid, cksize = struct.unpack_from("<4sI", mm, pos)
+				if ckid==b'LIST' and mm[pos+8:pos+12]==b'pdta':
+					spos=pos+12
+					send=min(end, pos+8+cksize)
+					while spos+8<=send:
+						sckid, scksize = struct.unpack_from("<4sI", mm, spos)
+						if sckid==b'phdr':
+							# Each record is 38 bytes. Last one is the terminal "EOP" record.
+							for i in range(scksize//38-1):
+								name, prg, bank = struct.unpack_from("<20sHH", mm, spos+8+i*38)
+								name=name.split(b'\0',1)[0].decode('latin-1').strip()
+								presets.append([bank, prg, name])
+							return sorted(presets, key=lambda p: (p[0], p[1]))
+						spos+=8+scksize+(scksize&1)
+				pos+=8+cksize+(cksize&1)
+	raise ValueError("SoundFont 2 file has no preset headers")
 
 #------------------------------------------------------------------------------
 # FluidSynth Engine Class
@@ -51,6 +87,10 @@ class zynthian_engine_fluidsynth(zynthian_engine):
 
 	fs_options = "-o synth.midi-bank-select=mma -o synth.cpu-cores=3 -o synth.polyphony=64"
 
+	# Soundfonts are loaded synchronously by set_preset
+	preset_settle_time = 0
+	concurrent_restore = True
+
 	soundfont_dirs=[
 		('EX', zynthian_engine.ex_data_dir + "/soundfonts/sf2"),
 		('MY', zynthian_engine.my_data_dir + "/soundfonts/sf2"),
@@ -91,6 +131,14 @@ class zynthian_engine_fluidsynth(zynthian_engine):
 		except:
 			super().stop()
 
+
+	# Soundfont IDs & MIDI routes are lost with the process. Layers keep their parts.
+	def restart(self):
+		super().restart()
+		self.soundfont_index={}
+		for layer in self.layers:
+			self.setup_router(layer)
+
 	# ---------------------------------------------------------------------------
 	# Layer Management
 	# ---------------------------------------------------------------------------
@@ -122,49 +170,53 @@ class zynthian_engine_fluidsynth(zynthian_engine):
 		return self.get_filelist(self.soundfont_dirs,"sf2")
 
 
+	# SoundFont is loaded when a preset is selected
 	def set_bank(self, layer, bank):
-		if self.load_soundfont(bank[0]):
-			self.unload_unused_soundfonts()
-			return True
-		else:
-			return False
+		return True
 
 	# ---------------------------------------------------------------------------
 	# Bank Management
 	# ---------------------------------------------------------------------------
 
 	def get_preset_list(self, bank):
+		return self._get_preset_list(bank)
+
+
+	@classmethod
+	def get_preset_index_lists(cls):
+		for bank in cls.get_filelist(cls.soundfont_dirs,"sf2"):
+			yield bank, cls._get_preset_list(bank)
+
+
+	@staticmethod
+	def _get_preset_list(bank):
 		logging.info("Getting Preset List for {}".format(bank[2]))
 		preset_list=[]
-		if bank[0] in self.soundfont_index:
-			sfi=self.soundfont_index[bank[0]]
-			output=self.proc_cmd("inst {}".format(sfi))
-			for f in output.split("\n"):
-				try:
-					prg=int(f[4:7])
-					bank_msb=int(f[0:3])
-					bank_lsb=int(bank_msb/128)
-					bank_msb=bank_msb%128
-					title=str.replace(f[8:-1], '_', ' ')
-					preset_list.append((f.strip(),[bank_msb,bank_lsb,prg],title,sfi))
-				except:
-					pass
-		else:
-			logging.warning("Bank {} is not loaded".format(bank[2]))
+		try:
+			sf2_presets=get_preset_catalog().get_or_scan('sf2', bank[0], [bank[0]], lambda: sf2_read_presets(bank[0]))
+		except Exception as e:
+			logging.error("Can't read presets from SoundFont '{}' => {}".format(bank[0], e))
+			return preset_list
+		for midi_bank, prg, name in sf2_presets:
+			bank_msb=midi_bank%128
+			bank_lsb=int(midi_bank/128)
+			title=str.replace(name, '_', ' ')
+			preset_list.append(("{:03d}-{:03d} {}".format(midi_bank, prg, name),(bank_msb,bank_lsb,prg),title,bank[0]))
 		return preset_list
 
 
 	def set_preset(self, layer, preset, preload=False):
-		sfi=preset[3]
-		if sfi in self.soundfont_index.values():
+		sfi=self.load_soundfont(preset[3])
+		if sfi is not None:
 			midi_bank=preset[1][0]+preset[1][1]*128
 			midi_prg=preset[1][2]
 			logging.debug("Set Preset => Layer: {}, SoundFont: {}, Bank: {}, Program: {}".format(layer.part_i, sfi, midi_bank, midi_prg))
 			self.proc_cmd("select {} {} {} {}".format(layer.part_i, sfi, midi_bank, midi_prg))
+			self.unload_unused_soundfonts()
 			layer.send_ctrl_midi_cc()
 			return True
 		else:
-			logging.warning("SoundFont {} is not loaded".format(sfi))
+			logging.warning("SoundFont {} can't be loaded".format(preset[3]))
 			return False
 
 
@@ -177,6 +229,14 @@ class zynthian_engine_fluidsynth(zynthian_engine):
 		except:
 			return False
 
+
+	@classmethod
+	def get_preset_files(cls, preset):
+		# Old snapshots store the soundfont ID instead of its path
+		if isinstance(preset[3], str):
+			return [preset[3]]
+		return []
+
 	# ---------------------------------------------------------------------------
 	# Specific functions
 	# ---------------------------------------------------------------------------
@@ -192,7 +252,9 @@ class zynthian_engine_fluidsynth(zynthian_engine):
 
 
 	def load_soundfont(self, sf):
-		if sf not in self.soundfont_index:
+		if sf in self.soundfont_index:
+			return self.soundfont_index[sf]
+		else:
 			logging.info("Loading SoundFont '{}' ...".format(sf))
 			# Send command to FluidSynth
 			output=self.proc_cmd("load \"{}\"".format(sf))
@@ -206,17 +268,17 @@ class zynthian_engine_fluidsynth(zynthian_engine):
 			# If soundfont was loaded succesfully ...
 			if sfi is not None:
 				logging.info("Loaded SoundFont '{}' => {}".format(sf,sfi))
+				# Insert ID in soundfont_index dictionary
+				self.soundfont_index[sf]=sfi
 				# Re-select presets for all layers to prevent instrument change
 				for layer in self.layers:
 					if layer.preset_info:
 						self.set_preset(layer, layer.preset_info)
-				# Insert ID in soundfont_index dictionary
-				self.soundfont_index[sf]=sfi
 				# Return soundfont ID
 				return sfi
 			else:
 				logging.warning("SoundFont '{}' can't be loaded".format(sf))
-				return False
+				return None
 
 
 	def setup_router(self, layer):
@@ -234,14 +296,12 @@ class zynthian_engine_fluidsynth(zynthian_engine):
 
 
 	def unload_unused_soundfonts(self):
-		#Make a copy of soundfont index and remove used soundfonts
+		#Make a copy of soundfont index and remove used soundfonts (selected or preloaded presets)
 		sf_unload=copy.copy(self.soundfont_index)
 		for layer in self.layers:
-			bi=layer.bank_info
-			if bi is not None:
-				if bi[2] and bi[0] in sf_unload:
-					#print("Skip "+bi[0]+"("+str(sf_unload[bi[0]])+")")
-					del sf_unload[bi[0]]
+			for pi in (layer.preset_info, layer.preload_info):
+				if pi is not None and pi[3] in sf_unload:
+					del sf_unload[pi[3]]
 		#Then, remove the remaining ;-)
 		for sf,sfi in sf_unload.items():
 			logging.info("Unload SoundFont => {}".format(sfi))
@@ -25,11 +25,13 @@
 import os
 import json
 import logging
-from os.path import isfile
+from os.path import isfile, join
+from threading import Thread
 from collections import OrderedDict
 
 from . import zynthian_engine
 from . import zynthian_controller
+from . import get_preset_catalog
 
 #------------------------------------------------------------------------------
 # Module methods
@@ -53,6 +55,13 @@ class zynthian_engine_jalv(zynthian_engine):
 
 	JALV_LV2_CONFIG_FILE = "{}/jalv/plugins.json".format(zynthian_engine.config_dir)
 
+	# Presets are set through the REPL, which answers when done
+	preset_settle_time = 0
+	concurrent_restore = True
+
+	# Dirs containing LV2 bundles (plugins & presets)
+	lv2_path = os.environ.get('LV2_PATH', "{}/.lv2:/usr/local/lib/lv2:/usr/lib/lv2".format(os.path.expanduser("~"))).split(":")
+
 	plugins_dict = OrderedDict([
 		("Dexed", {'TYPE': "MIDI Synth",'URL': "https://github.com/dcoredump/dexed.lv2"}),
 		("Helm", {'TYPE': "MIDI Synth",'URL': "http://tytel.org/helm"}),
@@ -148,10 +157,42 @@ class zynthian_engine_jalv(zynthian_engine):
 
 		self.command_prompt = "\n> "
 
+		self.jackname = None
+		self.start_output = None
+
+		# Plugin metadata (controls, presets & banks) is cached. If it's available,
+		# controllers are built while Jalv is starting.
+		catalog = get_preset_catalog()
+		metadata = catalog.get('jalv', self.plugin_url)
+		if metadata:
+			start_thread = Thread(target=self.start_jalv, args=())
+			start_thread.daemon = True
+			start_thread.start()
+			self.plugin_name = metadata['plugin_name']
+			self.init_plugin_metadata(metadata)
+			start_thread.join()
+			# Jalv failed to start => start it again, as without cached metadata
+			if not self.proc or not self.jackname:
+				logging.error("Jalv didn't start for '{}'. Retrying without cached metadata ...".format(self.plugin_url))
+				self.stop()
+				metadata = None
+
+		if not metadata:
+			self.start_jalv()
+			metadata = self.get_plugin_metadata()
+			self.init_plugin_metadata(metadata)
+			if self.proc:
+				bundles = self.get_plugin_bundles(self.plugin_url)
+				metadata['bundles'] = bundles
+				catalog.put('jalv', self.plugin_url, metadata, self.get_plugin_metadata_deps(bundles))
+
+		self.reset()
+
+
+	def start_jalv(self):
 		output = self.start()
 
 		# Get Plugin & Jack names from Jalv starting text ...
-		self.jackname = None
 		if output:
 			for line in output.split("\n"):
 				if line[0:15]=="JACK Real Name:":
@@ -162,6 +203,8 @@ class zynthian_engine_jalv(zynthian_engine):
 					self.plugin_name = line[11:].strip()
 					logging.debug("Plugin Name => {}".format(self.plugin_name))
 
+
+	def init_plugin_metadata(self, metadata):
 		# Set static MIDI Controllers from hardcoded plugin info
 		try:
 			self._ctrls = self.plugin_ctrl_info[self.plugin_name]['ctrls']
@@ -170,15 +213,75 @@ class zynthian_engine_jalv(zynthian_engine):
 			logging.info("No defined MIDI controllers for '{}'.".format(self.plugin_name))
 
 		# Generate LV2-Plugin Controllers
-		self.lv2_zctrl_dict = self.get_lv2_controllers_dict()
+		self.lv2_zctrl_dict = self.get_lv2_controllers_dict(metadata['controls'])
 		self.generate_ctrl_screens(self.lv2_zctrl_dict)
 
 		# Get preset list from plugin host
 		self.bank_npresets = {}
-		self.preset_list = self._get_preset_list()
-		self.bank_list = self._get_bank_list()
+		self.bank_presets = {}
+		self.preset_list = self._get_preset_list(metadata['presets'])
+		self.bank_list = self._get_bank_list(metadata['banks'])
 
-		self.reset()
+	#----------------------------------------------------------------------------
+	# Plugin Metadata
+	#----------------------------------------------------------------------------
+
+	# Query controls, presets & banks from the running plugin host
+	def get_plugin_metadata(self):
+		logging.info("Getting Metadata from LV2 Plugin ...")
+		metadata = {
+			'plugin_name': self.plugin_name,
+			'controls': [],
+			'presets': [],
+			'banks': []
+		}
+
+		for line in self.proc_cmd("\info_controls").split("\n"):
+			parts = line.split(" => ")
+			if len(parts)==2:
+				try:
+					metadata['controls'].append([parts[0], json.JSONDecoder().decode(parts[1])])
+				except Exception as e:
+					logging.error(e)
+
+		for line in sorted(self.proc_cmd("\get_presets").split("\n")):
+			parts = line.split(" => ")
+			if len(parts)==2:
+				metadata['presets'].append([parts[0].strip()] + [u.strip() for u in parts[1].strip().split(", ")])
+
+		for line in sorted(self.proc_cmd("\get_banks").split("\n")):
+			parts = line.split(" => ")
+			if len(parts)==2:
+				metadata['banks'].append([parts[0].strip(), parts[1].strip()])
+
+		return metadata
+
+
+	# Bundles referencing the plugin in their manifest: the plugin's bundle and its preset bundles
+	@classmethod
+	def get_plugin_bundles(cls, plugin_url):
+		res = []
+		uri_ref = "<{}>".format(plugin_url)
+		for dpath in cls.lv2_path:
+			try:
+				with os.scandir(dpath) as it:
+					for entry in it:
+						if entry.is_dir():
+							try:
+								with open(join(entry.path, "manifest.ttl"), errors='ignore') as f:
+									if uri_ref in f.read():
+										res.append(entry.path)
+							except OSError:
+								pass
+			except OSError:
+				pass
+		return res
+
+
+	# The cached metadata is valid while no bundle is added/removed and the plugin's bundles don't change
+	@classmethod
+	def get_plugin_metadata_deps(cls, bundles):
+		return cls.lv2_path + bundles + [join(b, "manifest.ttl") for b in bundles]
 
 	# ---------------------------------------------------------------------------
 	# Layer Management
@@ -201,21 +304,11 @@ class zynthian_engine_jalv(zynthian_engine):
 	# Bank Managament
 	#----------------------------------------------------------------------------
 
-	def _get_bank_list(self):
-		logging.info("Getting Bank List from LV2 Plugin ...")
-
+	def _get_bank_list(self, banks):
 		bank_list = []
-		output = self.proc_cmd("\get_banks")
-		for line in sorted(output.split("\n")):
-			try:
-				parts = line.split(" => ")
-				if len(parts)==2:
-					title = parts[0].strip()
-					url = parts[1].strip()
-					if url in self.bank_npresets:
-						bank_list.append((url, None, title, None))
-			except Exception as e:
-				logging.error(e)
+		for title, url in banks:
+			if url in self.bank_npresets:
+				bank_list.append((url, None, title, None))
 
 		if len(bank_list)==0:
 			bank_list.append(("", None, "", None))
@@ -236,43 +329,30 @@ class zynthian_engine_jalv(zynthian_engine):
 	# Preset Managament
 	#----------------------------------------------------------------------------
 
-	def _get_preset_list(self):
-		logging.info("Getting Preset List from LV2 Plugin ...")
-
+	def _get_preset_list(self, presets):
 		preset_list = []
-		output=self.proc_cmd("\get_presets")
-		for line in sorted(output.split("\n")):
-			try:
-				parts = line.split(" => ")
-				if len(parts)==2:
-					title = parts[0].strip()
-
-					uri_parts = parts[1].strip().split(", ")
-					uri_preset = uri_parts[0].strip()
-					uri_banks = uri_parts[1:]
-					if len(uri_banks)==0:
-						uri_banks.append("NoBank")
-					preset_list.append((uri_preset,None,title,uri_banks))
-
-					#Count presets/bank
-					for uri in uri_banks:
-						try:
-							self.bank_npresets[uri] += 1
-						except:
-							self.bank_npresets[uri] = 1
-
-			except Exception as e:
-				logging.error(e)
+		for preset in presets:
+			title = preset[0]
+			uri_preset = preset[1]
+			uri_banks = preset[2:]
+			if len(uri_banks)==0:
+				uri_banks.append("NoBank")
+			preset_list.append((uri_preset,None,title,tuple(uri_banks)))
+
+			#Count & index presets/bank
+			for uri in uri_banks:
+				try:
+					self.bank_npresets[uri] += 1
+					self.bank_presets[uri].append(preset_list[-1])
+				except:
+					self.bank_npresets[uri] = 1
+					self.bank_presets[uri] = [preset_list[-1]]
 
 		return preset_list
 
 
 	def get_preset_list(self, bank):
-		bank_preset_list = []
-		for preset in  self.preset_list:
-			if bank[0] in preset[3]:
-				bank_preset_list.append(preset)
-		return bank_preset_list
+		return self.bank_presets.get(bank[0], [])
 
 
 	def set_preset(self, layer, preset, preload=False):
@@ -303,80 +383,73 @@ class zynthian_engine_jalv(zynthian_engine):
 	# Controllers Managament
 	#----------------------------------------------------------------------------
 
-	def get_lv2_controllers_dict(self):
-		logging.info("Getting Controller List from LV2 Plugin ...")
-		output=self.proc_cmd("\info_controls")
+	def get_lv2_controllers_dict(self, controls):
 		zctrls=OrderedDict()
-		for line in output.split("\n"):
-			parts=line.split(" => ")
-			if len(parts)==2:
-				symbol=parts[0]
-				try:
-					info=json.JSONDecoder().decode(parts[1])
-
-					#If there is points info ...
-					if len(info['points'])>1:
-						labels=[]
-						values=[]
-						for p in info['points']:
-							labels.append(p['label'])
-							values.append(p['value'])
-						try:
-							val=info['value']
-						except:
-							val=labels[0]
-						zctrls[symbol]=zynthian_controller(self,symbol,info['label'],{
-							'graph_path': info['index'],
-							'value': val,
-							'labels': labels,
-							'ticks': values,
-							'value_min': values[0],
-							'value_max': values[-1],
-							'is_toggle': info['is_toggle'],
-							'is_integer': info['is_integer']
-						})
-
-					#If it's a normal controller ...
-					else:
-						r=info['max']-info['min']
-						if info['is_integer']:
-							if r==1 and info['is_toggle']:
-								if info['value']==0: val='off'
-								else: val='on'
-								zctrls[symbol]=zynthian_controller(self,symbol,info['label'],{
-									'graph_path': info['index'],
-									'value': val,
-									'labels': ['off','on'],
-									'ticks': [0,1],
-									'value_min': 0,
-									'value_max': 1,
-									'is_toggle': True,
-									'is_integer': True
-								})
-							else:
-								zctrls[symbol]=zynthian_controller(self,symbol,info['label'],{
-									'graph_path': info['index'],
-									'value': int(info['value']),
-									'value_default': int(info['default']),
-									'value_min': int(info['min']),
-									'value_max': int(info['max']),
-									'is_toggle': False,
-									'is_integer': True
-								})
+		for symbol, info in controls:
+			try:
+				#If there is points info ...
+				if len(info['points'])>1:
+					labels=[]
+					values=[]
+					for p in info['points']:
+						labels.append(p['label'])
+						values.append(p['value'])
+					try:
+						val=info['value']
+					except:
+						val=labels[0]
+					zctrls[symbol]=zynthian_controller(self,symbol,info['label'],{
+						'graph_path': info['index'],
+						'value': val,
+						'labels': labels,
+						'ticks': values,
+						'value_min': values[0],
+						'value_max': values[-1],
+						'is_toggle': info['is_toggle'],
+						'is_integer': info['is_integer']
+					})
+
+				#If it's a normal controller ...
+				else:
+					r=info['max']-info['min']
+					if info['is_integer']:
+						if r==1 and info['is_toggle']:
+							if info['value']==0: val='off'
+							else: val='on'
+							zctrls[symbol]=zynthian_controller(self,symbol,info['label'],{
+								'graph_path': info['index'],
+								'value': val,
+								'labels': ['off','on'],
+								'ticks': [0,1],
+								'value_min': 0,
+								'value_max': 1,
+								'is_toggle': True,
+								'is_integer': True
+							})
 						else:
-								zctrls[symbol]=zynthian_controller(self,symbol,info['label'],{
-									'graph_path': info['index'],
-									'value': info['value'],
-									'value_default': info['default'],
-									'value_min': info['min'],
-									'value_max': info['max'],
-									'is_toggle': False,
-									'is_integer': False
-								})
-
-				#If control info is not OK
-				except Exception as e:
-					logging.error(e)
+							zctrls[symbol]=zynthian_controller(self,symbol,info['label'],{
+								'graph_path': info['index'],
+								'value': int(info['value']),
+								'value_default': int(info['default']),
+								'value_min': int(info['min']),
+								'value_max': int(info['max']),
+								'is_toggle': False,
+								'is_integer': True
+							})
+					else:
+							zctrls[symbol]=zynthian_controller(self,symbol,info['label'],{
+								'graph_path': info['index'],
+								'value': info['value'],
+								'value_default': info['default'],
+								'value_min': info['min'],
+								'value_max': info['max'],
+								'is_toggle': False,
+								'is_integer': False
+							})
+
+			#If control info is not OK
+			except Exception as e:
+				logging.error(e)
 
 		return zctrls
 
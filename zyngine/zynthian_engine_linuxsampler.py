@@ -28,12 +28,12 @@ import logging
 import socket
 import shutil
 from time import sleep
-from os.path import isfile, isdir
-from subprocess import check_output
+from os.path import isfile, isdir, join
 from collections import OrderedDict
 
 from . import zynthian_engine
 from . import zynthian_controller
+from . import get_preset_catalog
 
 #------------------------------------------------------------------------------
 # Linuxsampler Exception Classes
@@ -76,6 +76,17 @@ class zynthian_engine_linuxsampler(zynthian_engine):
 	lscp_port = 6688
 	lscp_v1_6_supported=False
 
+	# LOAD INSTRUMENT is modal, so set_preset returns when the instrument is loaded
+	preset_settle_time = 0
+	concurrent_restore = True
+
+	# Max. dir depth for finding instruments in a bank
+	sfz_max_depth = 3
+	gig_max_depth = 2
+	exclude_sfz = re.compile(r"[MOPRSTV][1-9]?l?\.sfz")
+	sfz_path_opcodes = re.compile(r"\b(sample|default_path)=(.+?)(?=\s+\w+=|\s*<|\s*//|\s*$)", re.M)
+	scan_dir_memo = {}
+
 	bank_dirs = [
 		('ExSFZ', zynthian_engine.ex_data_dir + "/soundfonts/sfz"),
 		('ExGIG', zynthian_engine.ex_data_dir + "/soundfonts/gig"),
@@ -112,6 +123,17 @@ class zynthian_engine_linuxsampler(zynthian_engine):
 		self.ls_chans={}
 		self.ls_init()
 
+
+	def restart(self):
+		super().restart()
+		self.lscp_connect()
+		self.lscp_get_version()
+		self.reset()
+		for layer in self.layers:
+			layer.ls_chan_info=None
+			self.ls_set_channel(layer)
+			self.set_midi_chan(layer)
+
 	# ---------------------------------------------------------------------------
 	# Subproccess Management & IPC
 	# ---------------------------------------------------------------------------
@@ -257,36 +279,116 @@ class zynthian_engine_linuxsampler(zynthian_engine):
 	# Preset Management
 	# ---------------------------------------------------------------------------
 
-	@staticmethod
-	def _get_preset_list(bank):
+	@classmethod
+	def _get_preset_list(cls, bank):
 		logging.info("Getting Preset List for %s" % bank[2])
-		i=0
-		preset_list=[]
 		preset_dpath=bank[0]
-		if os.path.isdir(preset_dpath):
-			exclude_sfz = re.compile(r"[MOPRSTV][1-9]?l?\.sfz")
-			cmd="find '"+preset_dpath+"' -maxdepth 3 -type f -name '*.sfz'"
-			output=check_output(cmd, shell=True).decode('utf8')
-			cmd="find '"+preset_dpath+"' -maxdepth 2 -type f -name '*.gig'"
-			output=output+"\n"+check_output(cmd, shell=True).decode('utf8')
-			lines=output.split('\n')
-			for f in lines:
-				if f:
-					filehead,filetail=os.path.split(f)
-					if not exclude_sfz.fullmatch(filetail):
-						filename,filext=os.path.splitext(f)
-						filename = filename[len(preset_dpath)+1:]
-						title=filename.replace('_', ' ')
-						engine=filext[1:].lower()
-						preset_list.append((f,i,title,engine,"{}.{}".format(filename,filext)))
-						i=i+1
+		catalog=get_preset_catalog()
+		preset_list=catalog.get('linuxsampler', preset_dpath)
+		if preset_list is None:
+			preset_list=list(cls.scan_preset_list(bank))
+		else:
+			preset_list=[tuple(p) for p in preset_list]
 		return preset_list
 
 
+	# Scan the bank, yielding the presets as they are found, and store the list in the catalog when finished.
+	@classmethod
+	def scan_preset_list(cls, bank):
+		preset_dpath=bank[0]
+		visited_dirs=[]
+		preset_list=[]
+		for preset in cls.iter_preset_list(bank, visited_dirs):
+			preset_list.append(preset)
+			yield preset
+		# The catalog entry depends on every visited dir. Don't cache if any changed since it was listed.
+		catalog=get_preset_catalog()
+		if cls.get_scan_signature(visited_dirs)==catalog.get_deps_signature(visited_dirs):
+			catalog.put('linuxsampler', preset_dpath, preset_list, visited_dirs)
+
+
+	# Dir mtimes when they were listed by scan_dir
+	@classmethod
+	def get_scan_signature(cls, dpaths):
+		sig=[]
+		for dpath in dpaths:
+			memo=cls.scan_dir_memo.get(dpath)
+			sig.append([dpath, memo[0] if memo else None])
+		return sig
+
+
+	# Generator yielding the bank's presets in traversal order
+	@classmethod
+	def iter_preset_list(cls, bank, visited_dirs=None):
+		i=0
+		preset_dpath=bank[0]
+		for f in cls.walk_preset_files(preset_dpath, 1, visited_dirs):
+			filehead,filetail=os.path.split(f)
+			if not cls.exclude_sfz.fullmatch(filetail):
+				filename,filext=os.path.splitext(f)
+				filename = filename[len(preset_dpath)+1:]
+				title=filename.replace('_', ' ')
+				engine=filext[1:].lower()
+				yield (f,i,title,engine,"{}.{}".format(filename,filext))
+				i=i+1
+
+
+	# Depth-first walk of a bank dir, yielding SFZ & GIG files within depth limits
+	@classmethod
+	def walk_preset_files(cls, dpath, depth=1, visited_dirs=None):
+		if visited_dirs is not None:
+			visited_dirs.append(dpath)
+		files, subdirs = cls.scan_dir(dpath)
+		for f in files:
+			ext=f[-4:].lower()
+			if (ext=='.sfz' and depth<=cls.sfz_max_depth) or (ext=='.gig' and depth<=cls.gig_max_depth):
+				yield join(dpath,f)
+		if depth<max(cls.sfz_max_depth, cls.gig_max_depth):
+			for d in subdirs:
+				yield from cls.walk_preset_files(join(dpath,d), depth+1, visited_dirs)
+
+
+	# List regular files & subdirs in a dir, memoized until the dir's mtime changes
+	@classmethod
+	def scan_dir(cls, dpath):
+		try:
+			mtime=os.stat(dpath).st_mtime_ns
+			memo=cls.scan_dir_memo.get(dpath)
+			if memo and memo[0]==mtime:
+				return memo[1], memo[2]
+			files=[]
+			subdirs=[]
+			with os.scandir(dpath) as it:
+				for entry in it:
+					if entry.is_dir(follow_symlinks=False):
+						subdirs.append(entry.name)
+					elif entry.is_file(follow_symlinks=False):
+						files.append(entry.name)
+			files.sort()
+			subdirs.sort()
+			cls.scan_dir_memo[dpath]=(mtime, files, subdirs)
+			return files, subdirs
+		except OSError as e:
+			logging.debug("Can't scan directory {} => {}".format(dpath, e))
+			return [], []
+
+
 	def get_preset_list(self, bank):
 		return self._get_preset_list(bank)
 
 
+	# Banks not in the catalog are scanned while the preset list is shown
+	def get_preset_list_iter(self, bank):
+		if get_preset_catalog().get('linuxsampler', bank[0]) is None:
+			return self.scan_preset_list(bank)
+
+
+	@classmethod
+	def get_preset_index_lists(cls):
+		for bank in cls.get_dirlist(cls.bank_dirs):
+			yield bank, cls._get_preset_list(bank)
+
+
 	def set_preset(self, layer, preset, preload=False):
 		if self.ls_set_preset(layer, preset[3], preset[0]):
 			layer.send_ctrl_midi_cc()
@@ -304,6 +406,34 @@ class zynthian_engine_linuxsampler(zynthian_engine):
 		except:
 			return False
 
+
+	@classmethod
+	def get_preset_files(cls, preset):
+		if preset[3]=='sfz':
+			return [preset[0]] + cls.get_sfz_sample_files(preset[0])
+		else:
+			return [preset[0]]
+
+
+	# Sample files referenced by a SFZ file ("#include" directives are not followed)
+	@classmethod
+	def get_sfz_sample_files(cls, fpath):
+		res=[]
+		found=set()
+		dpath=os.path.dirname(fpath)
+		default_path=""
+		with open(fpath, errors='ignore') as f:
+			for m in cls.sfz_path_opcodes.finditer(f.read()):
+				value=m.group(2).strip().replace('\\', '/')
+				if m.group(1)=='default_path':
+					default_path=value
+				elif not value.startswith('*'):
+					spath=os.path.normpath(join(dpath, default_path + value))
+					if spath not in found:
+						found.add(spath)
+						res.append(spath)
+		return res
+
 	# ---------------------------------------------------------------------------
 	# Controllers Management
 	# ---------------------------------------------------------------------------
@@ -30,7 +30,7 @@ import requests
 import websocket
 from time import sleep
 from subprocess import check_output
-from threading  import Thread
+from threading  import Thread, Event, current_thread
 from collections import OrderedDict
 from . import zynthian_engine
 from . import zynthian_controller
@@ -48,6 +48,11 @@ class zynthian_engine_modui(zynthian_engine):
 	base_api_url = 'http://localhost:8888'
 	websocket_url = 'ws://localhost:8888/websocket'
 
+	api_timeout = 10
+	ws_load_timeout = 10
+	ws_coalesce_timeout = 0.02
+	ws_coalesce_max = 256
+
 	bank_dirs = [
 		('EX', zynthian_engine.ex_data_dir + "/presets/mod-ui/pedalboards"),
 		('_', zynthian_engine.my_data_dir + "/presets/mod-ui/pedalboards")
@@ -73,10 +78,13 @@ class zynthian_engine_modui(zynthian_engine):
 			'midi_chan': False
 		}
 
+		self.api_session = requests.Session()
 		self.websocket = None
 		self.ws_thread = None
-		self.ws_preset_loaded = False
-		self.ws_bundle_loaded = False
+		self.ws_preset_loaded = Event()
+		self.ws_bundle_loaded = Event()
+		self.ws_commands = {}
+		self.ws_pending_params = OrderedDict()
 		self.hw_ports = {}
 
 		self.reset()
@@ -144,16 +152,14 @@ class zynthian_engine_modui(zynthian_engine):
 
 	def load_bundle(self, path):
 		self.graph_reset()
-		self.ws_bundle_loaded = False
+		self.ws_bundle_loaded.clear()
 		res = self.api_post_request("/pedalboard/load_bundle/",data={'bundlepath':path})
 		if not res or not res['ok']:
 			logging.error("Loading Bundle "+path)
-		else:
-			return res['name']
-		i=0
-		while not self.ws_bundle_loaded and i<101: 
-			sleep(0.1)
-			i=i+2
+			return
+		#Wait for MOD-UI to confirm (loading_end) through the websocket
+		self.ws_wait(self.ws_bundle_loaded, "bundle '{}'".format(path))
+		return res['name']
 
 	#----------------------------------------------------------------------------
 	# Preset Managament
@@ -172,11 +178,11 @@ class zynthian_engine_modui(zynthian_engine):
 			for pid in sorted(presets):
 				title = presets[pid]
 				logging.debug("Add pedalboard preset " + title)
-				preset_entry = (pid, [0,0,0], title, '')
+				preset_entry = (pid, (0,0,0), title, '')
 				self.pedelpresets[pid] = preset_entry
 
 			preset_list = list(self.pedelpresets.values())
-			preset_list.append((None,[0,0,0],"-----------------------------", ''))
+			preset_list.append((None,(0,0,0),"-----------------------------", ''))
 
 		else:
 			preset_list = list()
@@ -188,7 +194,7 @@ class zynthian_engine_modui(zynthian_engine):
 				title = self.plugin_info[pgraph]['name'] + '/' + prs['label']
 				logging.debug("Add effect preset " + title)
 				preset_dict[prs['uri']] = len(preset_list)
-				preset_list.append((prs['uri'], [0,0,0], title, pgraph))
+				preset_list.append((prs['uri'], (0,0,0), title, pgraph))
 				self.plugin_info[pgraph]['presets_dict'] = preset_dict
 
 		return preset_list
@@ -203,21 +209,17 @@ class zynthian_engine_modui(zynthian_engine):
 
 
 	def load_effect_preset(self, plugin, preset):
-		self.ws_preset_loaded = False
+		self.ws_preset_loaded.clear()
 		res = self.api_get_request("/effect/preset/load/"+plugin, data={'uri':preset})
-		i=0
-		while not self.ws_preset_loaded and i<100: 
-			sleep(0.1)
-			i=i+1
+		if res is not None:
+			self.ws_wait(self.ws_preset_loaded, "effect preset '{}'".format(preset))
 
 
 	def load_pedalboard_preset(self, preset):
-		self.ws_preset_loaded = False
+		self.ws_preset_loaded.clear()
 		res = self.api_get_request("/pedalpreset/load", data={'id':preset})
-		i=0
-		while not self.ws_preset_loaded and i<100: 
-			sleep(0.1)
-			i=i+1
+		if res is not None:
+			self.ws_wait(self.ws_preset_loaded, "pedalboard preset '{}'".format(preset))
 
 
 	def cmp_presets(self, preset1, preset2):
@@ -294,81 +296,78 @@ class zynthian_engine_modui(zynthian_engine):
 			self.websocket.close()
 
 
+	# Wait for a websocket confirmation event. The websocket thread can't wait for itself!
+	def ws_wait(self, event, what):
+		if current_thread() is self.ws_thread:
+			return False
+		if not event.wait(self.ws_load_timeout):
+			logging.warning("Timeout waiting for MOD-UI to load {}".format(what))
+			return False
+		return True
+
+
+	def init_ws_commands(self):
+		# Websocket command table => handlers receive the raw argument string
+		self.ws_commands = {
+			"ping": self.ws_ping,
+			"add_hw_port": self.ws_add_hw_port,
+			"add": self.ws_add,
+			"remove": self.ws_remove,
+			"connect": self.ws_connect,
+			"disconnect": self.ws_disconnect,
+			"preset": self.ws_preset,
+			"pedal_preset": self.ws_pedal_preset,
+			"midi_map": self.ws_midi_map,
+			"loading_start": self.ws_loading_start,
+			"loading_end": self.ws_loading_end,
+			"bundlepath": self.ws_bundlepath,
+			"stop": self.ws_stop
+		}
+
+
 	def task_websocket(self):
 		error_counter=0
+		coalescing=False
+		self.init_ws_commands()
 		self.enable_midi_devices()
 		while True:
 			try:
+				# While there are pending param_set messages, don't block on receive
+				if coalescing!=bool(self.ws_pending_params):
+					coalescing=not coalescing
+					self.websocket.settimeout(self.ws_coalesce_timeout if coalescing else None)
+
 				received =  self.websocket.recv()
-				logging.debug("WS >> %s" % received)
-				args = received.split() 
-				command = args[0]
-
-				if command == "ping":
-					self.enable_midi_devices()
-					self.websocket.send("pong")
-					logging.debug("WS << pong")
-
-				elif command == "add_hw_port":
-					if args[3]=='1': pdir="output"
-					else: pdir="input"
-					self.add_hw_port_cb(args[2],pdir,args[1],args[4],args[5])
-
-				elif command == "add":
-					if args[2][0:4] == "http":
-						logging.info("ADD PLUGIN: "+args[1]+" => "+args[2])
-						self.add_plugin_cb(args[1],args[2],args[3],args[4])
-
-				elif command == "remove":
-					if args[1] == ":all":
-						logging.info("REMOVE ALL PLUGINS")
-						self.reset()
-					elif args[1]:
-						logging.info("REMOVE PLUGIN: "+args[1])
-						self.remove_plugin_cb(args[1])
-
-				elif command == "connect":
-					self.graph_connect_cb(args[1],args[2])
-
-				elif command == "disconnect":
-					self.graph_disconnect_cb(args[1],args[2])
-
-				elif command == "preset":
-					self.preset_cb(args[1],args[2])
-
-				elif command == "pedal_preset":
-					self.pedal_preset_cb(args[1])
-
-				elif command == "param_set":
-					self.set_param_cb(args[1],args[2],args[3])
-
-				elif command == "midi_map":
-					self.midi_map_cb(args[1],args[2],args[3],args[4])
-
-				elif command == "loading_start":
-					logging.info("LOADING START")
-					self.start_loading()
-
-				elif command == "loading_end":
-					logging.info("LOADING END")
-					self.graph_autoconnect_midi_input()
-					self.stop_loading()
-					self.ws_bundle_loaded = True
-
-				elif command == "bundlepath":
-					logging.info("BUNDLEPATH %s" % args[1])
-					self.bundlepath_cb(args[1])
-
-				elif command == "stop":
-					logging.error("Restarting MOD services ...")
-					self.stop()
-					self.start()
+				logging.debug("WS >> %s", received)
+				command, _, data = received.partition(" ")
+
+				# Coalesce bursts of param_set messages => only last value for every port is applied
+				if command == "param_set":
+					try:
+						pgraph, symbol, val = data.split(None, 2)
+						self.ws_pending_params[(pgraph, symbol)] = val
+					except ValueError:
+						logging.error("Bad param_set message: %s" % data)
+					if len(self.ws_pending_params)<self.ws_coalesce_max:
+						continue
+
+				self.flush_param_set()
+
+				try:
+					handler = self.ws_commands[command]
+				except KeyError:
+					continue
+				handler(data)
+
+			except websocket._exceptions.WebSocketTimeoutException:
+				self.flush_param_set()
 
 			except websocket._exceptions.WebSocketConnectionClosedException:
 				if self.is_service_active("mod-ui"):
 					try:
 						logging.error("Connection Closed. Retrying to connect ...")
 						self.websocket = websocket.create_connection(self.websocket_url)
+						coalescing=False
 						error_counter=0
 					except:
 						if error_counter>100:
@@ -389,9 +388,99 @@ class zynthian_engine_modui(zynthian_engine):
 				sleep(1)
 
 
+	#----------------------------------------------------------------------------
+	# Websocket command handlers
+	#----------------------------------------------------------------------------
+
+	def ws_ping(self, data):
+		self.enable_midi_devices()
+		self.websocket.send("pong")
+		logging.debug("WS << pong")
+
+
+	def ws_add_hw_port(self, data):
+		args = data.split()
+		if args[2]=='1': pdir="output"
+		else: pdir="input"
+		self.add_hw_port_cb(args[1],pdir,args[0],args[3],args[4])
+
+
+	def ws_add(self, data):
+		args = data.split()
+		if args[1][0:4] == "http":
+			logging.info("ADD PLUGIN: "+args[0]+" => "+args[1])
+			self.add_plugin_cb(args[0],args[1],args[2],args[3])
+
+
+	def ws_remove(self, data):
+		pgraph = data.strip()
+		if pgraph == ":all":
+			logging.info("REMOVE ALL PLUGINS")
+			self.ws_pending_params.clear()
+			self.reset()
+		elif pgraph:
+			logging.info("REMOVE PLUGIN: "+pgraph)
+			self.remove_plugin_cb(pgraph)
+
+
+	def ws_connect(self, data):
+		args = data.split()
+		self.graph_connect_cb(args[0],args[1])
+
+
+	def ws_disconnect(self, data):
+		args = data.split()
+		self.graph_disconnect_cb(args[0],args[1])
+
+
+	def ws_preset(self, data):
+		args = data.split()
+		self.preset_cb(args[0],args[1])
+
+
+	def ws_pedal_preset(self, data):
+		self.pedal_preset_cb(data.strip())
+
+
+	def ws_midi_map(self, data):
+		args = data.split()
+		self.midi_map_cb(args[0],args[1],args[2],args[3])
+
+
+	def ws_loading_start(self, data):
+		logging.info("LOADING START")
+		self.start_loading()
+
+
+	def ws_loading_end(self, data):
+		logging.info("LOADING END")
+		self.graph_autoconnect_midi_input()
+		self.stop_loading()
+		self.ws_bundle_loaded.set()
+
+
+	def ws_bundlepath(self, data):
+		bpath = data.strip()
+		logging.info("BUNDLEPATH %s" % bpath)
+		self.bundlepath_cb(bpath)
+
+
+	def ws_stop(self, data):
+		logging.error("Restarting MOD services ...")
+		self.stop()
+		self.start()
+
+
+	def flush_param_set(self):
+		if self.ws_pending_params:
+			for (pgraph, symbol), val in self.ws_pending_params.items():
+				self.set_param_cb(pgraph, symbol, val)
+			self.ws_pending_params.clear()
+
+
 	def api_get_request(self, path, data=None, json=None):
 		try:
-			res=requests.get(self.base_api_url + path, data=data, json=json)
+			res=self.api_session.get(self.base_api_url + path, data=data, json=json, timeout=self.api_timeout)
 		except Exception as e:
 			logging.error(e)
 			return
@@ -404,7 +493,7 @@ class zynthian_engine_modui(zynthian_engine):
 
 	def api_post_request(self, path, data=None, json=None):
 		try:
-			res=requests.post(self.base_api_url + path, data=data, json=json)
+			res=self.api_session.post(self.base_api_url + path, data=data, json=json, timeout=self.api_timeout)
 		except Exception as e:
 			logging.error(e)
 			return
@@ -421,16 +510,13 @@ class zynthian_engine_modui(zynthian_engine):
 			#Find bundle_path in bank list ...
 			layer=self.layers[0]
 			layer.load_bank_list()
-			for i in range(len(layer.bank_list)):
-				#logging.debug("BUNDLE PATH SEARCH => %s <=> %s" % (layer.bank_list[i][0].split('/')[-1], bdirname))
-				if layer.bank_list[i][0].split('/')[-1]==bdirname:
-					bank_index=i
-					bank_name=layer.bank_list[i][2]
-					#Set Bank in GUI, layer and engine without reloading the bundle
-					logging.info('Bank Selected from Bundlepath: ' + bank_name + ' (' + str(i)+')')
-					self.zyngui.screens['bank'].select(i)
-					layer.set_bank(i,False)
-					break
+			i=layer.get_list_index('bank_dirname', layer.bank_list, lambda b: b[0].split('/')[-1]).get(bdirname)
+			if i is not None:
+				bank_name=layer.bank_list[i][2]
+				#Set Bank in GUI, layer and engine without reloading the bundle
+				logging.info('Bank Selected from Bundlepath: ' + bank_name + ' (' + str(i)+')')
+				self.zyngui.screens['bank'].select(i)
+				layer.set_bank(i,False)
 
 
 	def add_hw_port_cb(self, ptype, pdir, pgraph, pname, pnum):
@@ -642,21 +728,19 @@ class zynthian_engine_modui(zynthian_engine):
 			self.zyngui.screens['control'].set_select_path()
 		except Exception as e:
 			logging.error("Preset Not Found: {}/{} => {}".format(pgraph, uri, e))
-		self.ws_preset_loaded = True
+		self.ws_preset_loaded.set()
 
 
 	def pedal_preset_cb(self, preset):
 		try:
-			preset_entry = self.pedelpresets[preset]
-			preset_entries = list(self.pedelpresets.values())
-			i = preset_entries.index(preset_entry)
+			i = self.layers[0].get_preset_index_by_uri(preset)
 			self.layers[0].set_preset(i, False)
 			self.zyngui.screens['control'].set_select_path()
 
 		except Exception as e:
 			logging.error("Preset Not Found: {}".format(preset))
 
-		self.ws_preset_loaded = True
+		self.ws_preset_loaded.set()
 
 	#----------------------------------------------------------------------------
 	# MIDI learning
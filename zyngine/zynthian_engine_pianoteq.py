@@ -29,13 +29,16 @@ import logging
 import time
 import shutil
 import struct
+import pexpect
 import subprocess
 from collections import defaultdict
-from os.path import isfile,isdir,join
+from os.path import join
 from xml.etree import ElementTree
 from json import JSONEncoder, JSONDecoder
 
 from . import zynthian_engine
+from . import freeze_list
+from . import get_preset_catalog
 
 #------------------------------------------------------------------------------
 # Pianoteq module helper functions
@@ -342,6 +345,13 @@ class zynthian_engine_pianoteq(zynthian_engine):
 	user_presets_dpath = PIANOTEQ_MY_PRESETS_DIR
 	user_presets_flist = None
 
+	# Max. number of preset mappings (program change) in a MIDI-mapping file
+	midimapping_size = 128
+	# Timeout waiting for the preset change confirmation (headless mode)
+	preset_load_timeout = 2
+	# set_preset waits for the preset change confirmation
+	preset_settle_time = 0
+
 	#----------------------------------------------------------------------------
 	# Initialization
 	#----------------------------------------------------------------------------
@@ -392,14 +402,14 @@ class zynthian_engine_pianoteq(zynthian_engine):
 		# Load (and generate if need it) the preset list
 		self.presets = defaultdict(list)
 		self.presets_cache_fpath = self.config_dir + '/pianoteq6/presets_cache.json'
-		if os.path.isfile(self.presets_cache_fpath) and not update_presets_cache:
-			self.load_presets_cache()
-		else:
+		if update_presets_cache or not self.load_presets_cache():
 			self.save_presets_cache()
 
 		self.load_user_presets()
 		self.purge_banks()
 		self.generate_presets_midimapping()
+		# Preset entries are shared between layers, so they must be immutable from now on
+		self.presets = { bank_name: freeze_list(presets) for bank_name, presets in self.presets.items() }
 
 
 	# ---------------------------------------------------------------------------
@@ -473,36 +483,93 @@ class zynthian_engine_pianoteq(zynthian_engine):
 	#----------------------------------------------------------------------------
 
 
+	# Character trie of bank names, for finding the bank of a preset name
+	@staticmethod
+	def get_bank_trie(bank_list):
+		trie = {}
+		for bank in bank_list:
+			if bank[0]:
+				node = trie
+				for c in bank[0]:
+					node = node.setdefault(c, {})
+				node[None] = bank[0]
+		return trie
+
+
+	# Longest bank name equal to the preset name or prefixing it, followed by a space
+	@staticmethod
+	def match_bank_trie(trie, name):
+		res = None
+		node = trie
+		for c in name:
+			if c==' ' and None in node:
+				res = node[None]
+			node = node.get(c)
+			if node is None:
+				return res
+		return node.get(None, res)
+
+
+	# All the bank names prefixing the name, followed by a space
+	@staticmethod
+	def match_bank_trie_prefixes(trie, name):
+		res = []
+		node = trie
+		for c in name:
+			if c==' ' and None in node:
+				res.append(node[None])
+			node = node.get(c)
+			if node is None:
+				break
+		return res
+
+
+	# The presets cache is valid while Pianoteq binary, licence & addons don't change
+	def get_presets_cache_signature(self):
+		try:
+			st = os.stat(PIANOTEQ_BINARY)
+			binary_sig = [st.st_size, st.st_mtime_ns]
+		except OSError:
+			binary_sig = None
+		try:
+			addons_sig = os.stat(PIANOTEQ_ADDON_DIR).st_mtime_ns
+		except OSError:
+			addons_sig = None
+		return {
+			'version': ".".join(map(str, PIANOTEQ_VERSION)),
+			'product': PIANOTEQ_PRODUCT,
+			'trial': PIANOTEQ_TRIAL,
+			'binary': binary_sig,
+			'subl': sorted(get_pianoteq_subl()),
+			'addons': addons_sig
+		}
+
+
 	def save_presets_cache(self):
 		logging.info("Caching Internal Presets ...")
 		#Get internal presets from Pianoteq ...
 		try:
 			pianoteq=subprocess.Popen([PIANOTEQ_BINARY, "--list-presets"],stdout=subprocess.PIPE)
-			bank_list = sorted(self.bank_list, key=lambda bank: len(bank[0]) if bank[0] else 0, reverse=True)
+			bank_trie = self.get_bank_trie(self.bank_list)
 			for line in pianoteq.stdout:
 				l=line.rstrip().decode("utf-8")
 				logging.debug("PRESET => {}".format(l))
-				for bank in bank_list:
-					try:
-						b=bank[0]
-						if b:
-							if b==l:
-								self.presets[b].append([l,None,'<default>',None])
-								break
-							elif b+' '==l[0:len(b)+1]:
-								#logging.debug("'%s' == '%s'" % (b,l[0:len(b)]))
-								preset_title=l[len(b):].strip()
-								preset_title=re.sub('^- ','',preset_title)
-								self.presets[b].append([l,None,preset_title,None])
-								break
-					except:
-						pass
+				b=self.match_bank_trie(bank_trie, l)
+				if b==l:
+					self.presets[b].append([l,None,'<default>',None])
+				elif b:
+					preset_title=l[len(b):].strip()
+					preset_title=re.sub('^- ','',preset_title)
+					self.presets[b].append([l,None,preset_title,None])
 		except Exception as e:
 			logging.error("Can't get internal presets: %s" %e)
 			return False
 		#Encode JSON
 		try:
-			json=JSONEncoder().encode(self.presets)
+			json=JSONEncoder().encode({
+				'signature': self.get_presets_cache_signature(),
+				'presets': self.presets
+			})
 			logging.info("Saving presets cache '%s' => \n%s" % (self.presets_cache_fpath,json))
 		except Exception as e:
 			logging.error("Can't generate JSON while saving presets cache: %s" %e)
@@ -521,6 +588,8 @@ class zynthian_engine_pianoteq(zynthian_engine):
 
 
 	def load_presets_cache(self):
+		if not os.path.isfile(self.presets_cache_fpath):
+			return False
 		#Load from file
 		try:
 			with open(self.presets_cache_fpath,"r") as fh:
@@ -531,23 +600,56 @@ class zynthian_engine_pianoteq(zynthian_engine):
 			return False
 		#Decode JSON
 		try:
-			self.presets=JSONDecoder().decode(json)
+			data=JSONDecoder().decode(json)
 		except Exception as e:
 			logging.error("Can't decode JSON while loading presets cache: %s" % e)
 			return False
+		#Check signature
+		if not isinstance(data, dict) or data.get('signature')!=self.get_presets_cache_signature():
+			logging.info("Presets cache is outdated")
+			return False
+		self.presets=data['presets']
 		return True
 
 
-	# Get user preset file list
+	# Sorted subdirs & preset files in a "My Presets" dir
+	@staticmethod
+	def scan_user_presets_dir(dpath):
+		subdirs = []
+		files = []
+		try:
+			with os.scandir(dpath) as it:
+				for entry in it:
+					if entry.is_dir():
+						subdirs.append(entry.name)
+					elif entry.is_file() and entry.name[-4:].lower()==".fxp":
+						files.append(entry.name)
+		except OSError as e:
+			logging.error("Can't scan user presets directory {} => {}".format(dpath, e))
+		return [sorted(subdirs), sorted(files)]
+
+
+	# Get user preset file list. Dir listings are cached until their mtime changes.
 	@classmethod
 	def get_user_preset_files(cls):
 		flist = []
-		for d in sorted(os.listdir(cls.user_presets_dpath)):
-			for f in sorted(os.listdir(cls.user_presets_dpath + "/" + d)):
+		catalog = get_preset_catalog()
+		dpath = cls.user_presets_dpath
+		for d in catalog.get_or_scan('pianoteq_user', dpath, [dpath], lambda: cls.scan_user_presets_dir(dpath))[0]:
+			ddpath = join(dpath, d)
+			for f in catalog.get_or_scan('pianoteq_user', ddpath, [ddpath], lambda: cls.scan_user_presets_dir(ddpath))[1]:
 				flist.append(d + "/" + f)
 		return flist
 
 
+	@staticmethod
+	def get_user_preset_entry(bank_name, f):
+		dbank,fname = f.split("/",1)
+		preset_path = dbank + "/" + fname[:-4]
+		preset_title = dbank + "/" + str.replace(fname[len(bank_name)+1:-4], '_', ' ').strip()
+		return [preset_path,None,preset_title,None,dbank]
+
+
 	# Get user presets
 	@classmethod
 	def get_user_presets(cls, bank):
@@ -557,27 +659,27 @@ class zynthian_engine_pianoteq(zynthian_engine):
 			bank_prefix = bank_name + " "
 			logging.debug("Getting User presets for {}".format(bank_name))
 			for f in cls.user_presets_flist:
-				if (isfile(join(cls.user_presets_dpath,f)) and f[-4:].lower()==".fxp"):
-					dbank,fname = f.split("/",1)
-					if bank_prefix==fname[0:len(bank_prefix)]:
-						preset_path = dbank + "/" + fname[:-4]
-						preset_title = dbank + "/" + str.replace(fname[len(bank_prefix):-4], '_', ' ').strip()
-						user_presets.append([preset_path,None,preset_title,None,dbank])
+				if bank_prefix==f.split("/",1)[1][0:len(bank_prefix)]:
+					user_presets.append(cls.get_user_preset_entry(bank_name, f))
 		return user_presets
 
 
 	# Get user presets
 	def load_user_presets(self):
 		type(self).user_presets_flist = self.get_user_preset_files()
-		for bank in self.bank_list:
-			user_presets = self.get_user_presets(bank)
-			if len(user_presets)>0:
-				#Add internal presets
-				bank_name = bank[0]
-				try:
-					self.presets[bank_name] = user_presets + self.presets[bank_name]
-				except:
-					self.presets[bank_name] = user_presets
+		bank_trie = self.get_bank_trie(self.bank_list)
+		user_presets = defaultdict(list)
+		# A user preset is added to every bank prefixing its name
+		for f in self.user_presets_flist:
+			for bank_name in self.match_bank_trie_prefixes(bank_trie, f.split("/",1)[1]):
+				user_presets[bank_name].append(self.get_user_preset_entry(bank_name, f))
+
+		for bank_name, presets in user_presets.items():
+			#Add internal presets
+			try:
+				self.presets[bank_name] = presets + self.presets[bank_name]
+			except:
+				self.presets[bank_name] = presets
 
 
 	# Remove banks without presets
@@ -606,10 +708,12 @@ class zynthian_engine_pianoteq(zynthian_engine):
 
 	def set_preset(self, layer, preset, preload=False):
 		mm = "Zynthian-{}".format(preset[3])
-		if mm == self.midimapping:
+		if mm == self.midimapping and self.proc:
+			# Fast path: the preset is in the loaded MIDI-mapping => program change
+			self.proc_flush_output()
 			super().set_preset(layer,preset,preload)
 			self.preset = preset[0]
-			time.sleep(1)
+			self.wait_preset_loaded()
 		else:
 			self.midimapping=mm
 			self.preset=preset[0]
@@ -624,6 +728,31 @@ class zynthian_engine_pianoteq(zynthian_engine):
 		return True
 
 
+	# Discard pending output, so the next prompt is the answer to the last action
+	def proc_flush_output(self):
+		try:
+			while True:
+				self.proc.read_nonblocking(4096, timeout=0)
+		except (pexpect.TIMEOUT, pexpect.EOF):
+			pass
+
+
+	# Headless Pianoteq reports every preset change with the command prompt
+	def wait_preset_loaded(self):
+		if self.command_prompt:
+			try:
+				self.proc.expect(self.command_prompt, timeout=self.preset_load_timeout)
+				return True
+			except pexpect.TIMEOUT:
+				logging.warning("Timeout waiting for Pianoteq preset '{}'".format(self.preset))
+			except Exception as e:
+				logging.error("Can't get Pianoteq preset confirmation => {}".format(e))
+			return False
+		else:
+			time.sleep(1)
+			return True
+
+
 	def cmp_presets(self, preset1, preset2):
 		try:
 			if preset1[0]==preset2[0] and preset1[2]==preset2[2]:
@@ -646,12 +775,18 @@ class zynthian_engine_pianoteq(zynthian_engine):
 			ensure_dir(PIANOTEQ_MIDIMAPPINGS_DIR + "/")
 			shutil.copy(self.data_dir + "/pianoteq6/Zynthian.ptm", PIANOTEQ_MIDIMAPPINGS_DIR + "/ZynthianControllers.ptm")
 
-		# Generate "Program Change" for Presets as MIDI-Mapping registers using Pianoteq binary format
+		# Generate "Program Change" for Presets as MIDI-Mapping registers using Pianoteq binary format.
+		# A bank is never split between files if it fits in one, so browsing a bank doesn't restart Pianoteq.
 		mmn = 0
 		data = []
 		for bank in self.bank_list:
 			if bank[0] in self.presets:
-				for prs in self.presets[bank[0]]:
+				bank_presets = self.presets[bank[0]]
+				if len(data)>0 and len(data)+len(bank_presets)>self.midimapping_size:
+					self.create_midimapping_file(mmn, data)
+					mmn += 1
+					data = []
+				for prs in bank_presets:
 					try:
 						#logging.debug("Generating Pianoteq MIDI-Mapping for {}".format(prs[0]))
 						midi_event_str = bytes("Program Change " + str(len(data)+1),"utf8")
@@ -662,7 +797,7 @@ class zynthian_engine_pianoteq(zynthian_engine):
 						prs[1] = len(data)
 						prs[3] = mmn
 						data.append(row)
-						if len(data)>127:
+						if len(data)>=self.midimapping_size:
 							self.create_midimapping_file(mmn, data)
 							mmn += 1
 							data = []
@@ -117,6 +117,12 @@ class zynthian_engine_puredata(zynthian_engine):
 		return self.get_dirlist(bank[0])
 
 
+	@classmethod
+	def get_preset_index_lists(cls):
+		for bank in cls.get_dirlist(cls.bank_dirs):
+			yield bank, cls.get_dirlist(bank[0])
+
+
 	def set_preset(self, layer, preset, preload=False):
 		self.load_preset_config(preset)
 		self.command=self.base_command+ " " + self.get_preset_filepath(preset)
@@ -22,11 +22,13 @@
 # 
 #******************************************************************************
 
+import os
 import re
 import logging
 import pexpect
 
 from . import zynthian_engine
+from . import get_preset_catalog
 
 #------------------------------------------------------------------------------
 # setBfree Engine Class
@@ -39,20 +41,20 @@ class zynthian_engine_setbfree(zynthian_engine):
 	# ---------------------------------------------------------------------------
 
 	bank_manuals_list = [
-		['Upper', 0, 'Upper', '_', [False, False, 59]],
-		['Lower + Upper', 1, 'Lower + Upper', '_', [True, False, 59]],
-		['Pedals + Upper', 2, 'Pedals + Upper', '_', [False, True, 59]],
-		['Pedals + Lower + Upper', 3, 'Pedals + Lower + Upper', '_', [True, True, 59]],
-		['Split: Lower + Upper', 4, 'Split Lower + Upper', '_', [True, False, 56]],
-		['Split: Pedals + Upper', 5, 'Split Pedals + Upper', '_', [False, True, 58]],
-		['Split: Pedals + Lower + Upper', 6, 'Split Pedals + Lower + Upper', '_', [True, True, 57]]
+		('Upper', 0, 'Upper', '_', (False, False, 59)),
+		('Lower + Upper', 1, 'Lower + Upper', '_', (True, False, 59)),
+		('Pedals + Upper', 2, 'Pedals + Upper', '_', (False, True, 59)),
+		('Pedals + Lower + Upper', 3, 'Pedals + Lower + Upper', '_', (True, True, 59)),
+		('Split: Lower + Upper', 4, 'Split Lower + Upper', '_', (True, False, 56)),
+		('Split: Pedals + Upper', 5, 'Split Pedals + Upper', '_', (False, True, 58)),
+		('Split: Pedals + Lower + Upper', 6, 'Split Pedals + Lower + Upper', '_', (True, True, 57))
 	]
 
 
 	bank_twmodels_list = [
-		['Sin', 0, 'Sine', '_'],
-		['Sqr', 1, 'Square', '_'],
-		['Tri', 2, 'Triangle', '_']
+		('Sin', 0, 'Sine', '_'),
+		('Sqr', 1, 'Square', '_'),
+		('Tri', 2, 'Triangle', '_')
 	]
 
 
@@ -165,6 +167,17 @@ class zynthian_engine_setbfree(zynthian_engine):
 		'overdrive_ogain': 'overdrive outputgain'
 	}
 
+	# Program values are stored as arrays, indexed like this list
+	_zcparams = list(_param2zcsymbol.keys())
+	_zcsymbols = list(_param2zcsymbol.values())
+
+	# Program bank (.pgm) parser
+	pgm_line_ptrn = re.compile("^([\d]+)[\s]*\{[\s]*name\=\"([^\"]+)\"")
+	pgm_split_ptrn = re.compile("[\s]*[\{\}\,]+[\s]*")
+
+	# Parsed program banks: fpath => (mtime, pgm_list)
+	program_list_memo = {}
+
 	#----------------------------------------------------------------------------
 	# Config variables
 	#----------------------------------------------------------------------------
@@ -240,11 +253,11 @@ class zynthian_engine_setbfree(zynthian_engine):
 			return self.bank_twmodels_list
 		else:
 			if layer.bank_name == "Upper":
-				return [[self.base_dir + "/pgm-banks/upper/most_popular.pgm",0, "Upper", "_"]]
+				return [(self.base_dir + "/pgm-banks/upper/most_popular.pgm",0, "Upper", "_")]
 			elif layer.bank_name == "Lower":
-				return [[self.base_dir + "/pgm-banks/lower/lower_voices.pgm",0, "Lower", "_"]]
+				return [(self.base_dir + "/pgm-banks/lower/lower_voices.pgm",0, "Lower", "_")]
 			elif layer.bank_name == "Pedals":
-				return [[self.base_dir + "/pgm-banks/pedals/pedals.pgm",0, "Pedals", "_"]]
+				return [(self.base_dir + "/pgm-banks/pedals/pedals.pgm",0, "Pedals", "_")]
 
 		#return self.get_filelist(self.get_bank_dir(layer),"pgm")
 
@@ -342,27 +355,18 @@ class zynthian_engine_setbfree(zynthian_engine):
 	#----------------------------------------------------------------------------
 
 	def update_controller_values(self, layer, preset):
-		#Get values from preset params and set them into controllers
-		for param, v in preset[3].items():
-			try:
-				zcsymbol=self._param2zcsymbol[param]
-			except Exception as e:
-				logging.debug("No controller for param {}".format(param))
+		refresh_gui = self.zyngui.active_screen=='control' and self.zyngui.screens['control'].mode=='control'
+		#Set program values (indexed like _zcsymbols) into controllers
+		for zcsymbol, v in zip(self._zcsymbols, preset[3]):
+			if v is None:
 				continue
-
 			try:
 				zctrl=layer.controllers_dict[zcsymbol]
-
-				if zctrl.symbol=='rotary speed':
-					if v=='tremolo': v='fast'
-					elif v=='chorale': v='slow'
-					else: v='off'
-
 				#logging.debug("Updating controller '{}' ({}) => {}".format(zctrl.symbol,zctrl.name,zctrl.value))
 				zctrl.set_value(v, True)
 
 				#Refresh GUI controller in screen when needed ...
-				if self.zyngui.active_screen=='control' and self.zyngui.screens['control'].mode=='control':
+				if refresh_gui:
 					self.zyngui.screens['control'].set_controller_value(zctrl)
 
 			except Exception as e:
@@ -401,22 +405,51 @@ class zynthian_engine_setbfree(zynthian_engine):
 		return bank_dir
 
 
-	def load_program_list(self,fpath):
+	# Program list from a bank file, cached until the file changes
+	@classmethod
+	def load_program_list(cls, fpath):
+		try:
+			mtime=os.stat(fpath).st_mtime_ns
+		except OSError as err:
+			logging.error("Getting program info from %s => %s" % (fpath,err))
+			return None
+
+		memo=cls.program_list_memo.get(fpath)
+		if memo and memo[0]==mtime:
+			return memo[1]
+
+		# Cached values are positional, so they're only valid for the same _zcparams layout
+		catalog=get_preset_catalog()
+		data=catalog.get('setbfree', fpath)
+		if isinstance(data, dict) and data.get('params')==cls._zcparams:
+			pgm_list=data['programs']
+		else:
+			pgm_list=cls.parse_program_list(fpath)
+			if pgm_list is None:
+				return None
+			catalog.put('setbfree', fpath, { 'params': cls._zcparams, 'programs': pgm_list }, [fpath])
+
+		pgm_list=[(i,(0,0,prg),title,tuple(values)) for i,prg,title,values in pgm_list]
+		cls.program_list_memo[fpath]=(mtime, pgm_list)
+		return pgm_list
+
+
+	# Parse a bank file into a list of [i, prg, title, values], with values indexed like _zcsymbols
+	@classmethod
+	def parse_program_list(cls, fpath):
 		pgm_list=None
 		try:
 			with open(fpath) as f:
 				pgm_list=[]
 				lines = f.readlines()
-				ptrn1=re.compile("^([\d]+)[\s]*\{[\s]*name\=\"([^\"]+)\"")
-				ptrn2=re.compile("[\s]*[\{\}\,]+[\s]*")
 				i=0
 				for line in lines:
 					#Test with first pattern
-					m=ptrn1.match(line)
+					m=cls.pgm_line_ptrn.match(line)
 					if not m: continue
 
 					#Get line parts...
-					fragments=ptrn2.split(line)
+					fragments=cls.pgm_split_ptrn.split(line)
 
 					params={}
 					try:
@@ -449,8 +482,15 @@ class zynthian_engine_setbfree(zynthian_engine):
 										j=j+1
 								del params['drawbars']
 
+							#Rotary speed controller values
+							if 'rotaryspeed' in params:
+								v=params['rotaryspeed']
+								if v=='tremolo': params['rotaryspeed']='fast'
+								elif v=='chorale': params['rotaryspeed']='slow'
+								else: params['rotaryspeed']='off'
+
 							#Add program to list
-							pgm_list.append((i,[0,0,prg],title,params))
+							pgm_list.append([i,prg,title,[params.get(p) for p in cls._zcparams]])
 							i=i+1
 					except:
 						#print("Ignored line: %s" % line)
@@ -27,9 +27,11 @@ import re
 import logging
 import liblo
 import shutil
-from time import sleep
+from time import sleep, monotonic
+from threading import Event
 from os.path import isfile, join
 from . import zynthian_engine
+from . import get_preset_catalog
 
 #------------------------------------------------------------------------------
 # ZynAddSubFX Engine Class
@@ -92,6 +94,11 @@ class zynthian_engine_zynaddsubfx(zynthian_engine):
 	# Config variables
 	#----------------------------------------------------------------------------
 
+	preset_load_timeout = 10
+	# set_preset waits for the part to be loaded
+	preset_settle_time = 0
+	concurrent_restore = True
+
 	bank_dirs = [
 		('EX', zynthian_engine.ex_data_dir + "/presets/zynaddsubfx"),
 		('MY', zynthian_engine.my_data_dir + "/presets/zynaddsubfx"),
@@ -120,6 +127,7 @@ class zynthian_engine_zynaddsubfx(zynthian_engine):
 		self.osc_paths_data = []
 		self.current_slot_zctrl = None
 		self.slot_zctrls = {}
+		self.preset_loaded = Event()
 
 		self.start()
 		self.osc_init()
@@ -166,12 +174,18 @@ class zynthian_engine_zynaddsubfx(zynthian_engine):
 	# Preset Managament
 	#----------------------------------------------------------------------------
 
+	@classmethod
+	def _get_preset_list(cls, bank):
+		logging.info("Getting Preset List for %s" % bank[2])
+		key="{}|{}".format(bank[1], bank[0])
+		return get_preset_catalog().get_entries('zynaddsubfx', key, [bank[0]], lambda: cls._scan_preset_list(bank))
+
+
 	@staticmethod
-	def _get_preset_list(bank):
+	def _scan_preset_list(bank):
 		preset_list=[]
 		preset_dir=bank[0]
 		index=0
-		logging.info("Getting Preset List for %s" % bank[2])
 		for f in sorted(os.listdir(preset_dir)):
 			preset_fpath=join(preset_dir,f)
 			ext=f[-3:].lower()
@@ -185,7 +199,7 @@ class zynthian_engine_zynaddsubfx(zynthian_engine):
 				bank_lsb=int(index/128)
 				bank_msb=bank[1]
 				prg=index%128
-				preset_list.append((preset_fpath,[bank_msb,bank_lsb,prg],title,ext,f))
+				preset_list.append((preset_fpath,(bank_msb,bank_lsb,prg),title,ext,f))
 		return preset_list
 
 
@@ -193,27 +207,39 @@ class zynthian_engine_zynaddsubfx(zynthian_engine):
 		return self._get_preset_list(bank)
 
 
+	@classmethod
+	def get_preset_index_lists(cls):
+		for bank in cls.get_dirlist(cls.bank_dirs):
+			yield bank, cls._get_preset_list(bank)
+
+
 	def set_preset(self, layer, preset, preload=False):
 		self.start_loading()
+		msgs=[]
 		if preset[3]=='xiz':
-			self.enable_part(layer)
-			liblo.send(self.osc_target, "/load-part",layer.part_i,preset[0])
+			msgs+=self.get_enable_part_msgs(layer)
+			msgs.append(("/load-part",layer.part_i,preset[0]))
 			#logging.debug("OSC => /load-part %s, %s" % (layer.part_i,preset[0]))
 		elif preset[3]=='xmz':
-			self.enable_part(layer)
-			liblo.send(self.osc_target, "/load_xmz",preset[0])
+			msgs+=self.get_enable_part_msgs(layer)
+			msgs.append(("/load_xmz",preset[0]))
 			logging.debug("OSC => /load_xmz %s" % preset[0])
 		elif preset[3]=='xsz':
-			liblo.send(self.osc_target, "/load_xsz",preset[0])
+			msgs.append(("/load_xsz",preset[0]))
 			logging.debug("OSC => /load_xsz %s" % preset[0])
 		elif preset[3]=='xlz':
-			liblo.send(self.osc_target, "/load_xlz",preset[0])
+			msgs.append(("/load_xlz",preset[0]))
 			logging.debug("OSC => /load_xlz %s" % preset[0])
-		liblo.send(self.osc_target, "/volume")
-		i=0
-		while self.loading and i<100: 
-			sleep(0.1)
-			i=i+1
+		# The /volume query is answered after the load is processed => completion signal
+		msgs.append(("/volume",))
+		self.preset_loaded.clear()
+		ts=monotonic()
+		self.osc_send_bundle(msgs)
+		if self.preset_loaded.wait(self.preset_load_timeout):
+			self.osc_latency.add(monotonic()-ts)
+		else:
+			logging.warning("Timeout loading preset '{}'".format(preset[0]))
+		self.stop_loading()
 		layer.send_ctrl_midi_cc()
 		return True
 
@@ -227,6 +253,11 @@ class zynthian_engine_zynaddsubfx(zynthian_engine):
 		except:
 			return False
 
+
+	@classmethod
+	def get_preset_files(cls, preset):
+		return [preset[0]]
+
 	# ---------------------------------------------------------------------------
 	# Specific functions
 	# ---------------------------------------------------------------------------
@@ -242,10 +273,18 @@ class zynthian_engine_zynaddsubfx(zynthian_engine):
 		return free_parts
 
 
-	def enable_part(self, layer):
+	def get_enable_part_msgs(self, layer):
 		if layer.part_i is not None:
-			liblo.send(self.osc_target, "/part%d/Penabled" % layer.part_i, True)
-			liblo.send(self.osc_target, "/part%d/Prcvchn" % layer.part_i, layer.get_midi_chan())
+			return [
+				("/part%d/Penabled" % layer.part_i, True),
+				("/part%d/Prcvchn" % layer.part_i, layer.get_midi_chan())
+			]
+		else:
+			return []
+
+
+	def enable_part(self, layer):
+		self.osc_send_bundle(self.get_enable_part_msgs(layer))
 
 
 	def disable_part(self, i):
@@ -253,15 +292,16 @@ class zynthian_engine_zynaddsubfx(zynthian_engine):
 
 
 	def enable_layer_parts(self):
+		msgs=[]
 		for layer in self.layers:
-			self.enable_part(layer)
+			msgs+=self.get_enable_part_msgs(layer)
 		for i in self.get_free_parts():
-			self.disable_part(i)
+			msgs.append(("/part%d/Penabled" % i, False))
+		self.osc_send_bundle(msgs)
 
 
 	def disable_all_parts(self):
-		for i in range(0,16):
-			self.disable_part(i)
+		self.osc_send_bundle([("/part%d/Penabled" % i, False) for i in range(0,16)])
 
 	#----------------------------------------------------------------------------
 	# OSC Managament
@@ -269,6 +309,7 @@ class zynthian_engine_zynaddsubfx(zynthian_engine):
 
 	def osc_add_methods(self):
 			self.osc_server.add_method("/volume", 'i', self.cb_osc_load_preset)
+			self.osc_server.add_method("/load-part", None, self.cb_osc_load_preset)
 			#self.osc_server.add_method("/paths", None, self.cb_osc_paths)
 			self.osc_server.add_method("/automate/active-slot", 'i', self.cb_osc_automate_active_slot)
 			for i in range(0,16):
@@ -278,7 +319,7 @@ class zynthian_engine_zynaddsubfx(zynthian_engine):
 
 
 	def cb_osc_load_preset(self, path, args):
-		self.stop_loading()
+		self.preset_loaded.set()
 
 	#----------------------------------------------------------------------------
 	# MIDI learning
@@ -346,16 +387,15 @@ class zynthian_engine_zynaddsubfx(zynthian_engine):
 			# set_midi_learn
 			if self.current_slot_zctrl.midi_learn_cc is not None:
 				zcc = (self.current_slot_zctrl.midi_learn_chan * 128) + self.current_slot_zctrl.midi_learn_cc
-				liblo.send(self.osc_target, "/automate/slot%d/learning" % slot_i, 0)
-				liblo.send(self.osc_target, "/automate/slot%d/active" % slot_i, True)
-				#sleep(0.05)
-				liblo.send(self.osc_target, "/automate/slot%d/name" % slot_i, self.current_slot_zctrl.symbol)
-				#logging.debug("OSC send => /automate/slot%d/name '%s'" % (slot_i, self.current_slot_zctrl.symbol))
-				liblo.send(self.osc_target, "/automate/slot%d/midi-cc" % slot_i, zcc)
-				#logging.debug("OSC send => /automate/slot%d/midi-cc %d" % (slot_i, zcc))
-				liblo.send(self.osc_target, "/automate/slot%d/param0/active" % slot_i, True)
-				liblo.send(self.osc_target, "/automate/slot%d/param0/used" % slot_i, True)
-				liblo.send(self.osc_target, "/automate/slot%d/param0/path" % slot_i, self.current_slot_zctrl.osc_path)
+				self.osc_send_bundle([
+					("/automate/slot%d/learning" % slot_i, 0),
+					("/automate/slot%d/active" % slot_i, True),
+					("/automate/slot%d/name" % slot_i, self.current_slot_zctrl.symbol),
+					("/automate/slot%d/midi-cc" % slot_i, zcc),
+					("/automate/slot%d/param0/active" % slot_i, True),
+					("/automate/slot%d/param0/used" % slot_i, True),
+					("/automate/slot%d/param0/path" % slot_i, self.current_slot_zctrl.osc_path)
+				])
 				logging.debug("Automate Slot %d SET: %s => %d" % (slot_i, self.current_slot_zctrl.osc_path, zcc))
 				self.current_slot_zctrl=None
 			# midi_learn
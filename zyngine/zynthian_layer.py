@@ -23,12 +23,20 @@
 #******************************************************************************
 
 import logging
-import copy
 from time import sleep
+from threading import Lock
 from collections import OrderedDict
 
+from . import get_preset_search, null_trace
+
 class zynthian_layer:
 
+	# Settle time (seconds) after loading a preset from a snapshot, for engines not acknowledging the load
+	snapshot_settle_time = 0.2
+
+	# Max time (seconds) to wait for the engine to finish loading a bank/preset
+	loading_timeout = 10
+
 	# ---------------------------------------------------------------------------
 	# Initialization
 	# ---------------------------------------------------------------------------
@@ -64,6 +72,14 @@ class zynthian_layer:
 		self.listen_midi_cc = True
 		self.refresh_flag = False
 
+		# While the layer state is being restored from a snapshot, zs3 recalls are deferred
+		self.restore_lock = Lock()
+		self.restoring = False
+		self.deferred_zs3 = None
+
+		# Lookup dictionaries for bank & preset lists: name => (list, len, {key: index})
+		self.list_index_cache = {}
+
 		self.reset_zs3()
 
 		self.engine.add_layer(self)
@@ -119,8 +135,12 @@ class zynthian_layer:
 
 
 	def load_bank_list(self):
+		old_bank_list=self.bank_list
 		self.bank_list=self.engine.get_bank_list(self)
+		self.reset_list_index_of(old_bank_list, self.bank_list)
 		logging.debug("BANK LIST => \n%s" % str(self.bank_list))
+		if self.bank_list:
+			get_preset_search().update_bank_list(self.engine.nickname, self.bank_list)
 
 
 	def reset_bank(self):
@@ -135,7 +155,7 @@ class zynthian_layer:
 			last_bank_name=self.bank_name
 			self.bank_index=i
 			self.bank_name=self.bank_list[i][2]
-			self.bank_info=copy.deepcopy(self.bank_list[i])
+			self.bank_info=self.bank_list[i]
 			logging.info("Bank Selected: %s (%d)" % (self.bank_name,i))
 
 			if set_engine and (last_bank_index!=i or not last_bank_name):
@@ -146,14 +166,21 @@ class zynthian_layer:
 		return False
 
 
-	#TODO Optimize search!!
 	def set_bank_by_name(self, name, set_engine=True):
-		for i in range(len(self.bank_list)):
-			if name==self.bank_list[i][2]:
-				return self.set_bank(i,set_engine)
+		i=self.get_bank_index_by_name(name)
+		if i is not None:
+			return self.set_bank(i,set_engine)
 		return False
 
 
+	def get_bank_index_by_name(self, name):
+		return self.get_list_index('bank_name', self.bank_list, lambda b: b[2]).get(name)
+
+
+	def get_bank_index_by_uri(self, uri):
+		return self.get_list_index('bank_uri', self.bank_list, lambda b: b[0]).get(uri)
+
+
 	def get_bank_name(self):
 		return self.preset_name
 
@@ -162,6 +189,30 @@ class zynthian_layer:
 		return self.bank_index
 
 
+	# Get a {key: index} dict for a bank/preset list, keeping the first occurrence of every key.
+	# It's rebuilt when the list is replaced or reloaded (engines may return the same list object, modified).
+	def get_list_index(self, name, lst, keyf):
+		cached=self.list_index_cache.get(name)
+		if cached and cached[0] is lst and cached[1]==len(lst):
+			return cached[2]
+		index={}
+		for i, item in enumerate(lst):
+			try:
+				key=keyf(item)
+				if key is not None and key not in index:
+					index[key]=i
+			except:
+				pass
+		self.list_index_cache[name]=(lst, len(lst), index)
+		return index
+
+
+	# Reset every index built on any of the lists, whatever its name (engines may add their own, i.e. MOD-UI)
+	def reset_list_index_of(self, *lists):
+		for name, cached in list(self.list_index_cache.items()):
+			if any(cached[0] is lst for lst in lists):
+				del self.list_index_cache[name]
+
 	# ---------------------------------------------------------------------------
 	# Presest Management
 	# ---------------------------------------------------------------------------
@@ -169,8 +220,17 @@ class zynthian_layer:
 
 	def load_preset_list(self):
 		if self.bank_info:
-			self.preset_list=self.engine.get_preset_list(self.bank_info)
-			logging.debug("PRESET LIST => \n%s" % str(self.preset_list))
+			self.set_preset_list(self.engine.get_preset_list(self.bank_info))
+
+
+	# Also used when the list has been filled incrementally (see engine's get_preset_list_iter)
+	def set_preset_list(self, preset_list):
+		old_preset_list=self.preset_list
+		self.preset_list=preset_list
+		self.reset_list_index_of(old_preset_list, self.preset_list)
+		logging.debug("PRESET LIST => \n%s" % str(self.preset_list))
+		if self.preset_list:
+			get_preset_search().update_preset_list(self.engine.nickname, self.bank_info, self.preset_list)
 
 
 	def reset_preset(self):
@@ -186,7 +246,7 @@ class zynthian_layer:
 			last_preset_name=self.preset_name
 			self.preset_index=i
 			self.preset_name=self.preset_list[i][2]
-			self.preset_info=copy.deepcopy(self.preset_list[i])
+			self.preset_info=self.preset_list[i]
 			self.preset_bank_index=self.bank_index
 
 			logging.info("Preset Selected: %s (%d)" % (self.preset_name,i))
@@ -216,19 +276,26 @@ class zynthian_layer:
 		return False
 
 
-	#TODO Optimize search!!
 	def set_preset_by_name(self, name, set_engine=True):
-		for i in range(len(self.preset_list)):
-			if name==self.preset_list[i][2]:
-				return self.set_preset(i,set_engine)
+		i=self.get_preset_index_by_name(name)
+		if i is not None:
+			return self.set_preset(i,set_engine)
 		return False
 
 
+	def get_preset_index_by_name(self, name):
+		return self.get_list_index('preset_name', self.preset_list, lambda p: p[2]).get(name)
+
+
+	def get_preset_index_by_uri(self, uri):
+		return self.get_list_index('preset_uri', self.preset_list, lambda p: p[0]).get(uri)
+
+
 	def preload_preset(self, i):
 		if i < len(self.preset_list) and (self.preload_info==None or not self.engine.cmp_presets(self.preload_info,self.preset_list[i])):
 			self.preload_index=i
 			self.preload_name=self.preset_list[i][2]
-			self.preload_info=copy.deepcopy(self.preset_list[i])
+			self.preload_info=self.preset_list[i]
 			logging.info("Preset Preloaded: %s (%d)" % (self.preload_name,i))
 			self.engine.set_preset(self,self.preload_info,True)
 			return True
@@ -363,7 +430,8 @@ class zynthian_layer:
 			'preset_name': self.preset_name,
 			'preset_info': self.preset_info,
 			'controllers_dict': {},
-			'zs3_list': self.zs3_list,
+			'zs3s': self.zs3_dict,
+			'zs3_base': self.zs3_base,
 			'active_screen_index': self.active_screen_index
 		}
 		for k in self.controllers_dict:
@@ -371,50 +439,102 @@ class zynthian_layer:
 		return snapshot
 
 
-	def restore_snapshot_1(self, snapshot):
+	# If reconcile is True, the layer is already running and bank/preset are only set when they differ
+	def restore_snapshot_1(self, snapshot, reconcile=False, trace=null_trace):
 		#Constructor, including engine and midi_chan info, is called before
 
+		same_bank = reconcile and self.bank_name is not None and self.bank_name==snapshot['bank_name']
+		same_preset = same_bank and self.preset_name is not None and self.preset_name==snapshot['preset_name']
+
 		#Load bank list and set bank
-		self.bank_name=snapshot['bank_name']	#tweak for working with setbfree extended config!! => TODO improve it!!
-		self.load_bank_list()
-		self.bank_name=None
-		self.set_bank_by_name(snapshot['bank_name'])
-		self.wait_stop_loading()
+		if not same_bank:
+			with trace.span(self.get_basepath(), "bank"):
+				self.bank_name=snapshot['bank_name']	#tweak for working with setbfree extended config!! => TODO improve it!!
+				self.load_bank_list()
+				self.bank_name=None
+				self.set_bank_by_name(snapshot['bank_name'])
+				self.wait_stop_loading()
 	
 		#Load preset list and set preset
-		self.load_preset_list()
-		self.preset_loaded=self.set_preset_by_name(snapshot['preset_name'])
-		self.wait_stop_loading()
+		if not same_preset:
+			with trace.span(self.get_basepath(), "preset"):
+				self.load_preset_list()
+				self.preset_loaded=self.set_preset_by_name(snapshot['preset_name'])
+				self.wait_stop_loading()
+		else:
+			self.preset_loaded=False
 
 		#Refresh controller config
 		if self.refresh_flag:
 			self.refresh_flag=False
-			self.refresh_controllers()
+			with trace.span(self.get_basepath(), "controllers"):
+				self.refresh_controllers()
 
-		#Set zs3 list
-		if 'zs3_list' in snapshot:
-			self.zs3_list = snapshot['zs3_list']
+		#Set zs3 dict
+		if 'zs3s' in snapshot:
+			self.set_zs3_dict(snapshot['zs3s'], snapshot.get('zs3_base'))
+		elif 'zs3_list' in snapshot:
+			self.set_zs3_list(snapshot['zs3_list'])
 
 		#Set active screen
 		if 'active_screen_index' in snapshot:
 			self.active_screen_index=snapshot['active_screen_index']
 
 
-	def restore_snapshot_2(self, snapshot):
+	# If reconcile is True, only controllers differing from the snapshot are set
+	# If settle is False, the caller has already waited for the preset to be loaded
+	def restore_snapshot_2(self, snapshot, reconcile=False, trace=null_trace, settle=True):
 
-		# Wait a little bit if a preset has been loaded 
-		if self.preset_loaded:
-			sleep(0.2)
+		# Wait for the engine if a preset has been loaded
+		if settle and self.preset_loaded:
+			self.wait_preset_settle(trace, self.get_snapshot_settle_time())
 
 		#Set controller values
-		for k in snapshot['controllers_dict']:
-			self.controllers_dict[k].restore_snapshot(snapshot['controllers_dict'][k])
+		with trace.span(self.get_basepath(), "controllers"):
+			for k in snapshot['controllers_dict']:
+				zctrl_snapshot=snapshot['controllers_dict'][k]
+				if reconcile and not self.preset_loaded:
+					zctrl=self.controllers_dict[k]
+					if zctrl_snapshot==zctrl.get_snapshot() or zctrl_snapshot==zctrl.value:
+						continue
+				self.controllers_dict[k].restore_snapshot(zctrl_snapshot)
+
+
+	# Wait for the engine to finish loading the preset. Engines not acknowledging the load need some settle time.
+	def wait_preset_settle(self, trace=null_trace, settle_time=None):
+		if settle_time is None:
+			settle_time = self.engine.preset_settle_time
+		with trace.span(self.get_basepath(), "settle"):
+			self.wait_stop_loading()
+			if settle_time>0:
+				sleep(settle_time)
+
+
+	def get_snapshot_settle_time(self):
+		return min(self.engine.preset_settle_time, self.snapshot_settle_time)
+
+
+	# Snapshot restore start & end. A zs3 recall received meanwhile is applied at the end.
+	def begin_restore(self):
+		with self.restore_lock:
+			self.restoring = True
+			self.deferred_zs3 = None
+
+
+	def end_restore(self):
+		with self.restore_lock:
+			self.restoring = False
+			i = self.deferred_zs3
+			self.deferred_zs3 = None
+		if i is not None:
+			self.restore_zs3(i)
 
 
 	def wait_stop_loading(self):
-		while self.engine.loading>0:
+		if self.engine.loading>0:
 			logging.debug("WAITING FOR STOP LOADING ...")
-			sleep(0.1)
+			if not self.engine.wait_stop_loading(self.loading_timeout):
+				logging.warning("Engine {} still loading after {} seconds. Giving up waiting!".format(self.engine.name, self.loading_timeout))
 
 
 	# ---------------------------------------------------------------------------
@@ -422,67 +542,204 @@ class zynthian_layer:
 	# ---------------------------------------------------------------------------
 
 
+	# ZS3s are stored in a dict of used slots. Each zs3 only stores the controller values differing from zs3_base,
+	# the controller values when the first zs3 was saved.
 	def reset_zs3(self):
-		self.zs3_list = [None]*128
+		self.zs3_dict = {}
+		self.zs3_base = None
+		# Compiled recall plans: i => (zs3, plan)
+		self.zs3_plans = {}
+
+
+	# Snapshot dict keys are strings when read from JSON
+	def set_zs3_dict(self, zs3s, base):
+		if all(isinstance(k, int) for k in zs3s):
+			self.zs3_dict = zs3s
+		else:
+			self.zs3_dict = {int(k): zs3s[k] for k in zs3s}
+		self.zs3_base = base
+		self.zs3_plans = {}
+
+
+	# Old snapshots store a 128-slot list of zs3s with all the controller values
+	def set_zs3_list(self, zs3_list):
+		self.reset_zs3()
+		for i, zs3 in enumerate(zs3_list):
+			if zs3:
+				zs3 = dict(zs3)
+				zs3.pop('bank_info', None)
+				zs3.pop('preset_info', None)
+				if self.zs3_base is None:
+					self.zs3_base = zs3['controllers_dict']
+				zs3['controllers_dict'] = self.get_zs3_delta(zs3['controllers_dict'])
+				self.zs3_dict[i] = zs3
+
+
+	# Controllers in the base but not in the layer are set to None
+	def get_zs3_delta(self, controllers):
+		base = self.zs3_base
+		delta = {k: v for k, v in controllers.items() if k not in base or base[k]!=v}
+		for k in base:
+			if k not in controllers:
+				delta[k] = None
+		return delta
 
 
 	def delete_zs3(self, i):
-		self.zs3_list[i] = None
+		self.zs3_dict.pop(i, None)
+		self.zs3_plans.pop(i, None)
+		if not self.zs3_dict:
+			self.zs3_base = None
 
 
 	def get_zs3(self, i):
-		return self.zs3_list[i]
+		return self.zs3_dict.get(i)
+
+
+	def get_zs3_used_indexes(self):
+		return list(self.zs3_dict.keys())
 
 
 	def save_zs3(self, i):
 		try:
+			controllers = {}
+			for k in self.controllers_dict:
+				controllers[k] = self.controllers_dict[k].get_snapshot()
+			if self.zs3_base is None:
+				self.zs3_base = controllers
+
 			zs3 = {
 				'bank_index': self.bank_index,
 				'bank_name': self.bank_name,
-				'bank_info': self.bank_info,
 				'preset_index': self.preset_index,
 				'preset_name': self.preset_name,
-				'preset_info': self.preset_info,
 				'active_screen_index': self.active_screen_index,
-				'controllers_dict': {}
+				'controllers_dict': self.get_zs3_delta(controllers)
 			}
 
-			for k in self.controllers_dict:
-				zs3['controllers_dict'][k] = self.controllers_dict[k].get_snapshot()
-
-			self.zs3_list[i] = zs3
+			self.zs3_dict[i] = zs3
+			self.zs3_plans[i] = (zs3, self.compile_zs3(zs3))
 
 		except Exception as e:
 			logging.error(e)
 
 
-	def restore_zs3(self, i):
-		zs3 = self.zs3_list[i]
+	# Compile a zs3 into a recall plan, resolving ahead of time as much as possible with the current lists & controllers:
+	# (bank_index, bank_name, preset_index, preset_name, active_screen_index, controllers, controllers_dict)
+	# where controllers is a tuple of (symbol, zctrl, zctrl_snapshot), zctrl being None if it can't be resolved.
+	def compile_zs3(self, zs3):
+		bank_name = zs3['bank_name']
+		bank_index = self.resolve_list_index(self.bank_list, zs3.get('bank_index'), bank_name, self.get_bank_index_by_name)
+
+		# The preset list can only be resolved if it's the bank's current one
+		preset_name = zs3['preset_name']
+		preset_index = zs3.get('preset_index')
+		if bank_name==self.bank_name and self.preset_list:
+			preset_index = self.resolve_list_index(self.preset_list, preset_index, preset_name, self.get_preset_index_by_name)
+
+		zctrl_values = dict(self.zs3_base or {})
+		zctrl_values.update(zs3['controllers_dict'])
+		return (
+			bank_index,
+			bank_name,
+			preset_index,
+			preset_name,
+			zs3.get('active_screen_index'),
+			self.resolve_zs3_controllers(zctrl_values),
+			self.controllers_dict
+		)
+
 
+	def resolve_zs3_controllers(self, zctrl_values):
+		return tuple((k, self.controllers_dict.get(k), v) for k, v in zctrl_values.items() if v is not None)
+
+
+	# Get the zs3 recall plan, compiling it if the zs3 or the controllers have changed
+	def get_zs3_plan(self, i):
+		zs3 = self.zs3_dict.get(i)
 		if zs3:
-			#Load bank list and set bank
-			self.load_bank_list()
-			self.set_bank_by_name(zs3['bank_name'])
-			self.wait_stop_loading()
+			cached = self.zs3_plans.get(i)
+			if cached and cached[0] is zs3 and cached[1][6] is self.controllers_dict:
+				return cached[1]
+			plan = self.compile_zs3(zs3)
+			self.zs3_plans[i] = (zs3, plan)
+			return plan
+
+
+	# Plan indexes are used if they still match the names, else names are searched
+	@staticmethod
+	def resolve_list_index(lst, index, name, get_index_by_name):
+		if index is not None and index<len(lst) and lst[index][2]==name:
+			return index
+		return get_index_by_name(name)
+
+
+	@staticmethod
+	def zctrl_matches_snapshot(zctrl, zctrl_snapshot):
+		if isinstance(zctrl_snapshot, dict):
+			return zctrl.value==zctrl_snapshot['value'] and zctrl.midi_learn_chan==zctrl_snapshot.get('midi_learn_chan') and zctrl.midi_learn_cc==zctrl_snapshot.get('midi_learn_cc')
+		else:
+			return zctrl.value==zctrl_snapshot
 
-			#Load preset list and set preset
-			self.load_preset_list()
-			self.set_preset_by_name(zs3['preset_name'])
-			self.wait_stop_loading()
+
+	def restore_zs3(self, i):
+		# Don't interfere with a snapshot being restored, neither block the caller (MIDI thread)
+		with self.restore_lock:
+			if self.restoring:
+				logging.info("Layer {} is being restored. ZS3 {} deferred".format(self.get_basepath(), i))
+				self.deferred_zs3 = i
+				return False
+
+		plan = self.get_zs3_plan(i)
+
+		if plan:
+			bank_index, bank_name, preset_index, preset_name, active_screen_index, zctrls, controllers_dict = plan
+
+			#Set bank, if different. The bank list is only reloaded if the compiled index doesn't match.
+			bank_changed = bank_name!=self.bank_name
+			if bank_changed:
+				if bank_index is None or bank_index>=len(self.bank_list) or self.bank_list[bank_index][2]!=bank_name:
+					self.load_bank_list()
+					bank_index = self.get_bank_index_by_name(bank_name)
+				if bank_index is not None:
+					self.set_bank(bank_index)
+					self.wait_stop_loading()
+
+			#Set preset, if different (or another one is preloaded)
+			preset_changed = bank_changed or preset_name!=self.preset_name or (self.preload_info is not None and not self.engine.cmp_presets(self.preload_info,self.preset_info))
+			if preset_changed:
+				if bank_changed or not self.preset_list:
+					self.load_preset_list()
+				preset_index = self.resolve_list_index(self.preset_list, preset_index, preset_name, self.get_preset_index_by_name)
+				if preset_index is not None:
+					self.set_preset(preset_index)
+					self.wait_stop_loading()
 
 			#Refresh controller config
 			if self.refresh_flag:
 				self.refresh_flag=False
 				self.refresh_controllers()
 
-			#Set active screen
-			if 'active_screen_index' in zs3:
-				self.active_screen_index=zs3['active_screen_index']
+			#Controllers were replaced (i.e. refreshed) since compiling => resolve them again
+			if controllers_dict is not self.controllers_dict:
+				zctrls = self.resolve_zs3_controllers({k: v for k, zctrl, v in zctrls})
 
-			#Set controller values
-			sleep(0.3)
-			for k in zs3['controllers_dict']:
-				self.controllers_dict[k].restore_snapshot(zs3['controllers_dict'][k])
+			#Set active screen
+			if active_screen_index is not None:
+				self.active_screen_index=active_screen_index
+
+			#Set controller values. If preset didn't change, only the differing ones.
+			if preset_changed and self.engine.preset_settle_time>0:
+				sleep(self.engine.preset_settle_time)
+			for k, zctrl, zctrl_snapshot in zctrls:
+				if zctrl is None:
+					logging.error("Can't restore controller '{}' => not found".format(k))
+					continue
+				try:
+					if preset_changed or not self.zctrl_matches_snapshot(zctrl, zctrl_snapshot):
+						zctrl.restore_snapshot(zctrl_snapshot)
+				except Exception as e:
+					logging.error("Can't restore controller '{}' => {}".format(k, e))
 
 			return True
 
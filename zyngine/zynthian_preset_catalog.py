@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+#******************************************************************************
+# ZYNTHIAN PROJECT: Zynthian Preset Catalog (zynthian_preset_catalog)
+#
+# Persistent catalog of bank & preset lists, validated by file/dir mtimes
+#
+# Copyright (C) 2015-2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#******************************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#******************************************************************************
+
+import os
+import json
+import sqlite3
+import logging
+from threading import Lock
+
+from . import freeze_entry
+
+#------------------------------------------------------------------------------
+# Preset Catalog Class
+#------------------------------------------------------------------------------
+
+class zynthian_preset_catalog:
+
+	schema_version = 1
+
+	def __init__(self, fpath):
+		self.fpath = fpath
+		self.lock = Lock()
+		self.db = None
+		try:
+			os.makedirs(os.path.dirname(fpath), exist_ok=True)
+			self.db = sqlite3.connect(fpath, check_same_thread=False)
+			if self.db.execute("PRAGMA user_version").fetchone()[0]!=self.schema_version:
+				self.db.execute("DROP TABLE IF EXISTS catalog")
+				self.db.execute("PRAGMA user_version={}".format(self.schema_version))
+			self.db.execute("CREATE TABLE IF NOT EXISTS catalog (kind TEXT, key TEXT, deps TEXT, data TEXT, PRIMARY KEY (kind, key))")
+			self.db.commit()
+		except Exception as e:
+			logging.error("Can't open preset catalog '{}' => {}".format(fpath, e))
+			self.db = None
+
+
+	# Signature of a list of files/dirs: [[path, mtime], ...]. Missing paths have mtime=None.
+	@staticmethod
+	def get_deps_signature(deps):
+		sig = []
+		for path in deps:
+			try:
+				sig.append([path, os.stat(path).st_mtime_ns])
+			except OSError:
+				sig.append([path, None])
+		return sig
+
+
+	# Return the cached data if it's still valid, None otherwise
+	def get(self, kind, key):
+		if self.db:
+			try:
+				with self.lock:
+					row = self.db.execute("SELECT deps, data FROM catalog WHERE kind=? AND key=?", (kind, key)).fetchone()
+				if row:
+					deps = json.loads(row[0])
+					if deps==self.get_deps_signature([d[0] for d in deps]):
+						return json.loads(row[1])
+			except Exception as e:
+				logging.error("Can't read preset catalog entry {}:{} => {}".format(kind, key, e))
+
+
+	def put(self, kind, key, data, deps):
+		if self.db:
+			try:
+				row = (kind, key, json.dumps(self.get_deps_signature(deps)), json.dumps(data))
+				with self.lock:
+					self.db.execute("INSERT OR REPLACE INTO catalog (kind, key, deps, data) VALUES (?,?,?,?)", row)
+					self.db.commit()
+			except Exception as e:
+				logging.error("Can't write preset catalog entry {}:{} => {}".format(kind, key, e))
+
+
+	def remove(self, kind, key=None):
+		if self.db:
+			try:
+				with self.lock:
+					if key is None:
+						self.db.execute("DELETE FROM catalog WHERE kind=?", (kind,))
+					else:
+						self.db.execute("DELETE FROM catalog WHERE kind=? AND key=?", (kind, key))
+					self.db.commit()
+			except Exception as e:
+				logging.error("Can't remove preset catalog entries {}:{} => {}".format(kind, key, e))
+
+
+	# Get data from catalog, calling scan() for refreshing it when deps have changed
+	def get_or_scan(self, kind, key, deps, scan):
+		data = self.get(kind, key)
+		if data is None:
+			sig = self.get_deps_signature(deps)
+			data = scan()
+			# Don't cache if deps changed while scanning
+			if sig==self.get_deps_signature(deps):
+				self.put(kind, key, data, deps)
+		return data
+
+
+	# Same as get_or_scan, for lists of immutable entries
+	def get_entries(self, kind, key, deps, scan):
+		return [freeze_entry(e) for e in self.get_or_scan(kind, key, deps, scan)]
+
+#------------------------------------------------------------------------------
+# Shared catalog instance
+#------------------------------------------------------------------------------
+
+preset_catalog = None
+
+def get_preset_catalog():
+	global preset_catalog
+	if preset_catalog is None:
+		config_dir = os.environ.get('ZYNTHIAN_CONFIG_DIR',"/zynthian/config")
+		preset_catalog = zynthian_preset_catalog(config_dir + "/preset_catalog.db")
+	return preset_catalog
+
+#------------------------------------------------------------------------------
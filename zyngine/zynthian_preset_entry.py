@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+#******************************************************************************
+# ZYNTHIAN PROJECT: Zynthian Preset Entries (zynthian_preset_entry)
+#
+# Immutable bank & preset entries, shared between layers without copying
+#
+# Copyright (C) 2015-2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#******************************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#******************************************************************************
+
+#------------------------------------------------------------------------------
+# Read-only dict, for entry params
+#------------------------------------------------------------------------------
+
+class zynthian_frozen_dict(dict):
+
+	__slots__ = ()
+
+	def _readonly(self, *args, **kwargs):
+		raise TypeError("Preset entry params are read-only")
+
+	__setitem__ = __delitem__ = _readonly
+	clear = pop = popitem = setdefault = update = _readonly
+
+	def __copy__(self):
+		return self
+
+	def __deepcopy__(self, memo):
+		return self
+
+	def __reduce__(self):
+		return (self.__class__, (dict(self),))
+
+#------------------------------------------------------------------------------
+# Freezing functions
+#------------------------------------------------------------------------------
+
+# Recursively convert lists to tuples and dicts to read-only dicts.
+# Bank & preset entries are immutable, so layers can share them by reference.
+def freeze_entry(entry):
+	if isinstance(entry, (list, tuple)):
+		return tuple(freeze_entry(e) for e in entry)
+	elif isinstance(entry, dict) and not isinstance(entry, zynthian_frozen_dict):
+		return zynthian_frozen_dict((k, freeze_entry(v)) for k, v in entry.items())
+	return entry
+
+
+def freeze_list(entries):
+	return [freeze_entry(e) for e in entries]
+
+#------------------------------------------------------------------------------
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+#******************************************************************************
+# ZYNTHIAN PROJECT: Zynthian Preset Prefetch (zynthian_preset_prefetch)
+#
+# Background read-ahead of the presets around the preset selector cursor
+#
+# Copyright (C) 2015-2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#******************************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#******************************************************************************
+
+
+import os
+import logging
+from threading import Thread, Condition
+from collections import OrderedDict
+
+#------------------------------------------------------------------------------
+# Preset Prefetch Class
+#------------------------------------------------------------------------------
+
+class zynthian_preset_prefetch:
+
+	# Number of presets prefetched at each side of the cursor
+	neighbours = 2
+	# Max. bytes read-ahead for a cursor position
+	max_bytes = 256*1024*1024
+	# Files are read-ahead by chunks, so stale requests are cancelled quickly
+	chunk_size = 8*1024*1024
+	# Number of recently prefetched files that are not read-ahead again
+	recent_size = 32
+
+	def __init__(self):
+		self.cond = Condition()
+		self.generation = 0
+		self.job = None
+		self.recent = OrderedDict()
+		self.thread = None
+		self.exit_flag = False
+
+
+	def start(self):
+		if not self.thread:
+			self.exit_flag = False
+			self.thread = Thread(target=self.task, args=())
+			self.thread.daemon = True # thread dies with the program
+			self.thread.start()
+
+
+	def stop(self):
+		with self.cond:
+			self.exit_flag = True
+			self.cond.notify()
+		self.thread = None
+
+
+	# Prefetch the neighbours of preset_list[index], cancelling any previous request
+	def request(self, engine, preset_list, index):
+		with self.cond:
+			self.generation += 1
+			self.job = (self.generation, engine, preset_list, index)
+			self.cond.notify()
+
+
+	def cancel(self):
+		with self.cond:
+			self.generation += 1
+			self.job = None
+
+
+	def is_stale(self, generation):
+		return generation!=self.generation or self.exit_flag
+
+
+	def task(self):
+		while True:
+			with self.cond:
+				while self.job is None and not self.exit_flag:
+					self.cond.wait()
+				if self.exit_flag:
+					return
+				job = self.job
+				self.job = None
+			try:
+				self.prefetch(*job)
+			except Exception as e:
+				logging.error("Preset prefetch failed => {}".format(e))
+
+
+	# Cursor first, then alternating next & previous presets
+	def get_neighbour_indexes(self, n, index):
+		res = [index]
+		for d in range(1, self.neighbours+1):
+			for i in (index+d, index-d):
+				if i>=0 and i<n:
+					res.append(i)
+		return res
+
+
+	def prefetch(self, generation, engine, preset_list, index):
+		budget = self.max_bytes
+		for i in self.get_neighbour_indexes(len(preset_list), index):
+			if preset_list[i][0] is None:
+				continue
+			try:
+				fpaths = engine.get_preset_files(preset_list[i])
+			except Exception as e:
+				logging.debug("Can't get files for preset {} => {}".format(preset_list[i][2], e))
+				continue
+			for fpath in fpaths:
+				if self.is_stale(generation):
+					return
+				budget = self.prefetch_file(generation, fpath, budget)
+				if budget<=0:
+					return
+
+
+	def prefetch_file(self, generation, fpath, budget):
+		try:
+			fd = os.open(fpath, os.O_RDONLY)
+		except OSError as e:
+			logging.debug("Can't prefetch {} => {}".format(fpath, e))
+			return budget
+
+		try:
+			st = os.fstat(fd)
+			key = (st.st_mtime_ns, st.st_size)
+			if self.recent.get(fpath)==key:
+				self.recent.move_to_end(fpath)
+				return budget
+			offset = 0
+			while offset<st.st_size and budget>0:
+				if self.is_stale(generation):
+					return budget
+				n = min(self.chunk_size, st.st_size-offset, budget)
+				self.readahead(fd, offset, n)
+				offset += n
+				budget -= n
+			if offset>=st.st_size:
+				self.recent[fpath] = key
+				if len(self.recent)>self.recent_size:
+					self.recent.popitem(last=False)
+			logging.debug("Prefetched {} ({} bytes)".format(fpath, offset))
+		except OSError as e:
+			logging.debug("Can't prefetch {} => {}".format(fpath, e))
+		finally:
+			os.close(fd)
+		return budget
+
+
+	# Load a file region into the OS page cache
+	@staticmethod
+	def readahead(fd, offset, length):
+		if hasattr(os, 'posix_fadvise'):
+			os.posix_fadvise(fd, offset, length, os.POSIX_FADV_WILLNEED)
+		else:
+			os.lseek(fd, offset, os.SEEK_SET)
+			while length>0:
+				data = os.read(fd, min(length, 1024*1024))
+				if not data:
+					break
+				length -= len(data)
+
+#------------------------------------------------------------------------------
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+#******************************************************************************
+# ZYNTHIAN PROJECT: Zynthian Preset Search (zynthian_preset_search)
+#
+# Fuzzy search of bank & preset titles from all engines, using a trigram index
+#
+# Copyright (C) 2015-2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#******************************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#******************************************************************************
+
+import re
+import heapq
+import logging
+from threading import Thread, Lock
+from collections import defaultdict, Counter
+
+#------------------------------------------------------------------------------
+# Preset Search Class
+#------------------------------------------------------------------------------
+
+class zynthian_preset_search:
+
+	max_results = 20
+
+	# Engines indexed from their running instance (bank/preset lists live in memory)
+	instance_index_nicks = ("PT", "JV/")
+
+	re_normalize = re.compile(r"[^0-9a-z]+")
+
+	def __init__(self):
+		self.lock = Lock()
+		# id => (engine_nick, bank_name, preset_name)
+		self.entries = {}
+		# id => entry trigrams
+		self.entry_grams = {}
+		# trigram => {entry trigrams count => set of ids}
+		self.grams = defaultdict(dict)
+		# entry trigrams count => number of entries
+		self.sizes = Counter()
+		# (engine_nick, bank_name) => list of ids. Bank lists use bank_name=None.
+		self.sources = {}
+		self.next_id = 0
+
+
+	@classmethod
+	def normalize(cls, text):
+		return cls.re_normalize.sub(" ", text.lower()).strip()
+
+
+	@classmethod
+	def get_trigrams(cls, text):
+		grams = set()
+		for w in cls.normalize(text).split():
+			w = " " + w + " "
+			for i in range(len(w)-2):
+				grams.add(w[i:i+3])
+		return grams
+
+	#----------------------------------------------------------------------------
+	# Index update
+	#----------------------------------------------------------------------------
+
+	# Replace all the entries from a source by a new list of (bank_name, preset_name, title)
+	def set_source(self, engine_nick, bank_name, items):
+		key = (engine_nick, bank_name)
+		with self.lock:
+			for eid in self.sources.pop(key, []):
+				del self.entries[eid]
+				grams = self.entry_grams.pop(eid)
+				size = len(grams)
+				for g in grams:
+					self.grams[g][size].discard(eid)
+				self.sizes[size] -= 1
+				if self.sizes[size] <= 0:
+					del self.sizes[size]
+			ids = []
+			for bname, pname, title in items:
+				eid = self.next_id
+				self.next_id += 1
+				grams = self.get_trigrams(title)
+				self.entries[eid] = (engine_nick, bname, pname)
+				self.entry_grams[eid] = grams
+				size = len(grams)
+				for g in grams:
+					self.grams[g].setdefault(size, set()).add(eid)
+				self.sizes[size] += 1
+				ids.append(eid)
+			self.sources[key] = ids
+
+
+	@staticmethod
+	def get_title(entry):
+		try:
+			if entry[0] is not None and isinstance(entry[2], str):
+				return entry[2]
+		except:
+			pass
+
+
+	def update_bank_list(self, engine_nick, bank_list):
+		items = []
+		for bank in bank_list:
+			title = self.get_title(bank)
+			if title:
+				items.append((title, None, title))
+		self.set_source(engine_nick, None, items)
+
+
+	def update_preset_list(self, engine_nick, bank, preset_list):
+		bank_name = self.get_title(bank)
+		if bank_name:
+			items = []
+			for preset in preset_list:
+				title = self.get_title(preset)
+				if title:
+					items.append((bank_name, title, title))
+			self.set_source(engine_nick, bank_name, items)
+
+
+	# Index a list of (bank, preset_list)
+	def index_lists(self, engine_nick, index_lists):
+		bank_list = []
+		for bank, preset_list in index_lists:
+			bank_list.append(bank)
+			self.update_preset_list(engine_nick, bank, preset_list)
+		if bank_list:
+			self.update_bank_list(engine_nick, bank_list)
+
+
+	# Index every bank & preset of an engine class
+	def index_engine_class(self, engine_nick, engine_class):
+		self.index_lists(engine_nick, engine_class.get_preset_index_lists())
+
+
+	# Indexing jobs for a running engine instance. Its lists are copied from the calling thread,
+	# so the indexing thread doesn't call into the live engine.
+	def get_engine_jobs(self, engine):
+		if engine.nickname.startswith(self.instance_index_nicks):
+			index_lists = [(bank, list(engine.get_preset_list(bank))) for bank in engine.get_bank_list()]
+			return [(self.index_lists, (engine.nickname, index_lists))]
+		return []
+
+
+	# Run indexing jobs (function, args) in background
+	def start_indexing(self, jobs):
+		thread = Thread(target=self.indexing_task, args=(jobs,))
+		thread.daemon = True
+		thread.start()
+
+
+	def indexing_task(self, jobs):
+		for func, args in jobs:
+			try:
+				func(*args)
+			except Exception as e:
+				logging.error("Preset search indexing failed => {}".format(e))
+		logging.info("Preset search index: {} entries".format(len(self.entries)))
+
+	#----------------------------------------------------------------------------
+	# Search
+	#----------------------------------------------------------------------------
+
+	# Returns a ranked list of (score, engine_nick, bank_name, preset_name). Banks have preset_name=None.
+	def search(self, query, n=None):
+		if n is None:
+			n = self.max_results
+		qgrams = self.get_trigrams(query)
+		if not qgrams:
+			return []
+		nq = len(qgrams)
+		with self.lock:
+			# Entries are bucketed by their trigrams count (ne). Sharing at most min(nq, ne) trigrams, they can't
+			# score more than 2*min(nq, ne)/(nq+ne): buckets are scanned by decreasing bound until it can't make the top n.
+			qbuckets = [self.grams[g] for g in qgrams if g in self.grams]
+			bounds = sorted(((2*min(nq, ne)/(nq+ne), ne) for ne in self.sizes), reverse=True)
+			best = []
+			for bound, ne in bounds:
+				if len(best) >= n and bound < best[0][0]:
+					break
+				counts = Counter()
+				for buckets in qbuckets:
+					if ne in buckets:
+						counts.update(buckets[ne])
+				# Dice coefficient over trigrams. Within a bucket it grows with the shared trigrams count.
+				for c, eid in heapq.nlargest(n, zip(counts.values(), counts.keys())):
+					item = (2*c/(nq+ne), eid)
+					if len(best) < n:
+						heapq.heappush(best, item)
+					elif item > best[0]:
+						heapq.heapreplace(best, item)
+					else:
+						break
+			best.sort(reverse=True)
+			return [(score,) + self.entries[eid] for score, eid in best]
+
+#------------------------------------------------------------------------------
+# Shared search instance
+#------------------------------------------------------------------------------
+
+preset_search = None
+
+def get_preset_search():
+	global preset_search
+	if preset_search is None:
+		preset_search = zynthian_preset_search()
+	return preset_search
+
+#------------------------------------------------------------------------------
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#******************************************************************************
+# ZYNTHIAN PROJECT: Zynthian Snapshot Codec (zynthian_snapshot_codec)
+#
+# Snapshot encoding: JSON or compact binary (msgpack), with lazy decoding
+#
+# Copyright (C) 2015-2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#******************************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#******************************************************************************
+
+
+import logging
+from json import JSONEncoder, JSONDecoder
+
+try:
+	import msgpack
+except ImportError:
+	msgpack = None
+
+#------------------------------------------------------------------------------
+# Binary format
+#------------------------------------------------------------------------------
+
+# Binary snapshots start with the magic bytes, followed by the schema version byte
+binary_magic = b"ZSSB"
+binary_schema_version = 1
+
+# Layer sections stored as nested msgpack blobs, decoded on first access.
+# The zs3 items are stored as blobs too.
+lazy_layer_keys = ('controllers_dict', 'zs3_base')
+
+#------------------------------------------------------------------------------
+# Lazy containers
+#------------------------------------------------------------------------------
+
+class zynthian_lazy_list(list):
+
+	def __getitem__(self, i):
+		v = super().__getitem__(i)
+		if isinstance(v, bytes):
+			v = msgpack.unpackb(v, raw=False)
+			super().__setitem__(i, v)
+		return v
+
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self[i]
+
+
+	# Items without decoding
+	def raw_items(self):
+		return list.__iter__(self)
+
+
+# If lazy_keys is None, all the values are lazy
+class zynthian_lazy_dict(dict):
+
+	def __init__(self, data, lazy_keys=None):
+		super().__init__(data)
+		self.lazy_keys = lazy_keys
+
+
+	def __getitem__(self, key):
+		v = super().__getitem__(key)
+		if isinstance(v, bytes) and (self.lazy_keys is None or key in self.lazy_keys):
+			v = msgpack.unpackb(v, raw=False)
+			super().__setitem__(key, v)
+		return v
+
+
+	def get(self, key, default=None):
+		if key in self:
+			return self[key]
+		return default
+
+
+	# Items without decoding
+	def raw_items(self):
+		return dict.items(self)
+
+#------------------------------------------------------------------------------
+# Encoding
+#------------------------------------------------------------------------------
+
+def is_binary_available():
+	return msgpack is not None
+
+
+# Encode a snapshot dict as bytes, using format "json" or "msgpack"
+def encode_snapshot(snapshot, fmt="json"):
+	if fmt=="msgpack":
+		if msgpack is not None:
+			data = pack_snapshot(snapshot)
+			return binary_magic + bytes([binary_schema_version]) + msgpack.packb(data, use_bin_type=True)
+		logging.warning("msgpack is not available. Saving snapshot as JSON.")
+	return JSONEncoder().encode(unpack_lazy_sections(snapshot)).encode("utf-8")
+
+
+# Lazy sections are packed as nested blobs. Not yet decoded sections are reused as they are.
+def pack_snapshot(snapshot):
+	res = dict(snapshot)
+	res['layers'] = []
+	for lss in snapshot['layers']:
+		lss = dict(lss)
+		for key in lazy_layer_keys:
+			if key in lss and not isinstance(lss[key], bytes):
+				lss[key] = msgpack.packb(lss[key], use_bin_type=True)
+		if 'zs3s' in lss:
+			zs3s = lss['zs3s']
+			if isinstance(zs3s, zynthian_lazy_dict):
+				zs3s = zs3s.raw_items()
+			else:
+				zs3s = zs3s.items()
+			lss['zs3s'] = {str(k): z if isinstance(z, bytes) else msgpack.packb(z, use_bin_type=True) for k, z in zs3s}
+		if 'zs3_list' in lss:
+			zs3_list = lss['zs3_list']
+			if isinstance(zs3_list, zynthian_lazy_list):
+				zs3_list = zs3_list.raw_items()
+			lss['zs3_list'] = [z if z is None or isinstance(z, bytes) else msgpack.packb(z, use_bin_type=True) for z in zs3_list]
+		res['layers'].append(lss)
+	return res
+
+
+# Decode all the lazy sections, for encoding as JSON
+def unpack_lazy_sections(snapshot):
+	res = dict(snapshot)
+	res['layers'] = []
+	for lss in snapshot['layers']:
+		lss = {k: lss[k] for k in lss}
+		if isinstance(lss.get('zs3s'), zynthian_lazy_dict):
+			lss['zs3s'] = {k: lss['zs3s'][k] for k in lss['zs3s']}
+		if isinstance(lss.get('zs3_list'), zynthian_lazy_list):
+			lss['zs3_list'] = list(lss['zs3_list'])
+		res['layers'].append(lss)
+	return res
+
+#------------------------------------------------------------------------------
+# Decoding
+#------------------------------------------------------------------------------
+
+# Decode a snapshot from bytes, detecting the format
+def decode_snapshot(data):
+	if data[0:len(binary_magic)]==binary_magic:
+		if msgpack is None:
+			raise ValueError("msgpack is not available for loading binary snapshot")
+		version = data[len(binary_magic)]
+		if version!=binary_schema_version:
+			raise ValueError("Unsupported binary snapshot version {}".format(version))
+		snapshot = msgpack.unpackb(data[len(binary_magic)+1:], raw=False)
+		snapshot['layers'] = [unpack_layer_snapshot(lss) for lss in snapshot['layers']]
+		return snapshot
+	else:
+		return JSONDecoder().decode(data.decode("utf-8"))
+
+
+def unpack_layer_snapshot(lss):
+	lss = zynthian_lazy_dict(lss, lazy_layer_keys)
+	if 'zs3s' in lss:
+		lss['zs3s'] = zynthian_lazy_dict({int(k): z for k, z in lss['zs3s'].items()})
+	if 'zs3_list' in lss:
+		lss['zs3_list'] = zynthian_lazy_list(lss['zs3_list'])
+	return lss
+
+#------------------------------------------------------------------------------
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#******************************************************************************
+# ZYNTHIAN PROJECT: Zynthian Snapshot Prewarm (zynthian_snapshot_prewarm)
+#
+# Background parsing of snapshots & read-ahead of their preset files
+#
+# Copyright (C) 2015-2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#******************************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#******************************************************************************
+
+
+import os
+import logging
+from threading import Lock
+from collections import OrderedDict
+
+from . import zynthian_preset_prefetch, decode_snapshot
+
+#------------------------------------------------------------------------------
+# Snapshot Prewarm Class
+#------------------------------------------------------------------------------
+
+class zynthian_snapshot_prewarm(zynthian_preset_prefetch):
+
+	# Max. bytes read-ahead for a bank of snapshots
+	max_bytes = 1024*1024*1024
+	# Max. number of parsed snapshots kept
+	max_snapshots = 128
+
+	def __init__(self):
+		super().__init__()
+		self.lock = Lock()
+		# fpath => ((mtime, size), snapshot)
+		self.snapshots = OrderedDict()
+
+
+	# Parse the snapshot files & read-ahead their preset files, cancelling any previous request.
+	# engine_classes is a dict engine_nick => engine class.
+	def request(self, fpaths, engine_classes):
+		with self.cond:
+			self.generation += 1
+			self.job = (self.generation, list(fpaths), engine_classes)
+			self.cond.notify()
+
+
+	# Snapshot files are parsed first, so the next program change finds them ready
+	def prefetch(self, generation, fpaths, engine_classes):
+		snapshots = []
+		for fpath in fpaths:
+			if self.is_stale(generation):
+				return
+			snapshot = self.parse(fpath)
+			if snapshot:
+				snapshots.append(snapshot)
+
+		budget = self.max_bytes
+		for fpath in self.get_snapshot_files(snapshots, engine_classes):
+			if self.is_stale(generation):
+				return
+			budget = self.prefetch_file(generation, fpath, budget)
+			if budget<=0:
+				return
+
+
+	@staticmethod
+	def get_file_key(fpath):
+		st = os.stat(fpath)
+		return (st.st_mtime_ns, st.st_size)
+
+
+	def parse(self, fpath):
+		try:
+			key = self.get_file_key(fpath)
+			with self.lock:
+				if fpath in self.snapshots and self.snapshots[fpath][0]==key:
+					return self.snapshots[fpath][1]
+			with open(fpath,"rb") as fh:
+				snapshot = decode_snapshot(fh.read())
+			with self.lock:
+				self.snapshots[fpath] = (key, snapshot)
+				self.snapshots.move_to_end(fpath)
+				if len(self.snapshots)>self.max_snapshots:
+					self.snapshots.popitem(last=False)
+			logging.debug("Prewarmed snapshot {}".format(fpath))
+			return snapshot
+		except Exception as e:
+			logging.debug("Can't prewarm snapshot {} => {}".format(fpath, e))
+
+
+	# Preset files used by the layers in a list of snapshots, without duplicates
+	@staticmethod
+	def get_snapshot_files(snapshots, engine_classes):
+		res = []
+		found = set()
+		for snapshot in snapshots:
+			for lss in snapshot['layers']:
+				engine_class = engine_classes.get(lss.get('engine_nick'))
+				if engine_class is None or not lss.get('preset_info'):
+					continue
+				try:
+					fpaths = engine_class.get_preset_files(lss['preset_info'])
+				except Exception as e:
+					logging.debug("Can't get files for preset {} => {}".format(lss.get('preset_name'), e))
+					continue
+				for fpath in fpaths:
+					if isinstance(fpath, str) and fpath not in found:
+						found.add(fpath)
+						res.append(fpath)
+		return res
+
+
+	# Return the parsed snapshot if it's up to date, None otherwise.
+	# Parsed snapshots are handed over only once, as the loaded layers take ownership of their data.
+	def take(self, fpath):
+		with self.lock:
+			item = self.snapshots.pop(fpath, None)
+		if item:
+			try:
+				if item[0]==self.get_file_key(fpath):
+					return item[1]
+			except OSError:
+				pass
+
+#------------------------------------------------------------------------------
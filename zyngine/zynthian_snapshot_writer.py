@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#******************************************************************************
+# ZYNTHIAN PROJECT: Zynthian Snapshot Writer (zynthian_snapshot_writer)
+#
+# Write-behind snapshot persistence, with atomic replace & coalescing of saves
+#
+# Copyright (C) 2015-2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#******************************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#******************************************************************************
+
+
+import os
+import logging
+from threading import Thread, Condition
+from collections import OrderedDict
+from concurrent.futures import Future
+
+#------------------------------------------------------------------------------
+# Snapshot Writer Class
+#------------------------------------------------------------------------------
+
+class zynthian_snapshot_writer:
+
+	# Max. time (seconds) waiting for pending writes when stopping
+	flush_timeout = 10
+
+	def __init__(self):
+		self.cond = Condition()
+		# fpath => (data, future), in request order
+		self.pending = OrderedDict()
+		self.writing = None
+		self.thread = None
+		self.exit_flag = False
+
+
+	def start(self):
+		with self.cond:
+			if not self.thread or not self.thread.is_alive():
+				self.exit_flag = False
+				self.thread = Thread(target=self.task, args=())
+				self.thread.daemon = True # thread dies with the program
+				self.thread.start()
+
+
+	# Write pending snapshots and stop the worker
+	def stop(self):
+		self.flush(self.flush_timeout)
+		with self.cond:
+			self.exit_flag = True
+			self.cond.notify_all()
+		self.thread = None
+
+
+	# Queue the encoded snapshot data for writing to fpath. Returns a future with the result (True/False).
+	# Data still waiting for the same path is replaced, and its future is shared.
+	def save(self, fpath, data):
+		self.start()
+		with self.cond:
+			if fpath in self.pending and not self.pending[fpath][1].cancelled():
+				future = self.pending[fpath][1]
+			else:
+				future = Future()
+			self.pending[fpath] = (data, future)
+			self.cond.notify_all()
+		return future
+
+
+	# Wait until all the pending snapshots are written
+	def flush(self, timeout=None):
+		with self.cond:
+			return self.cond.wait_for(lambda: not self.pending and self.writing is None, timeout)
+
+
+	def task(self):
+		while True:
+			with self.cond:
+				while not self.pending and not self.exit_flag:
+					self.cond.wait()
+				if self.exit_flag:
+					return
+				fpath, (data, future) = self.pending.popitem(last=False)
+				self.writing = fpath
+			try:
+				# Cancelled futures are not written
+				if future.set_running_or_notify_cancel():
+					future.set_result(self.write(fpath, data))
+			except Exception as e:
+				logging.error("Snapshot writer failed on '{}': {}".format(fpath, e))
+			finally:
+				with self.cond:
+					self.writing = None
+					self.cond.notify_all()
+
+
+	# Write to a temporary file and rename it, so the snapshot file is never left half-written
+	@staticmethod
+	def write(fpath, data):
+		tmp_fpath = fpath + ".tmp"
+		try:
+			with open(tmp_fpath,"wb") as fh:
+				fh.write(data)
+				fh.flush()
+				os.fsync(fh.fileno())
+			os.replace(tmp_fpath, fpath)
+			# Persist the rename
+			dfd = os.open(os.path.dirname(fpath) or ".", os.O_RDONLY)
+			try:
+				os.fsync(dfd)
+			finally:
+				os.close(dfd)
+			logging.debug("Snapshot saved '{}'".format(fpath))
+			return True
+
+		except Exception as e:
+			logging.error("Can't save snapshot '{}': {}".format(fpath, e))
+			try:
+				os.remove(tmp_fpath)
+			except OSError:
+				pass
+			return False
+
+#------------------------------------------------------------------------------
+# Shared writer instance
+#------------------------------------------------------------------------------
+
+snapshot_writer = None
+
+def get_snapshot_writer():
+	global snapshot_writer
+	if snapshot_writer is None:
+		snapshot_writer = zynthian_snapshot_writer()
+	return snapshot_writer
+
+#------------------------------------------------------------------------------
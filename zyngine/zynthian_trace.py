@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+#******************************************************************************
+# ZYNTHIAN PROJECT: Zynthian Timing Trace (zynthian_trace)
+#
+# Phase timing traces, saved in Chrome trace-event format
+#
+# Copyright (C) 2015-2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#******************************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#******************************************************************************
+
+
+import os
+import json
+import logging
+from time import perf_counter
+from threading import Lock, get_ident
+from contextlib import contextmanager
+from collections import OrderedDict
+
+#------------------------------------------------------------------------------
+# Timing Trace Class
+#------------------------------------------------------------------------------
+
+class zynthian_trace:
+
+	def __init__(self, name, enabled=True):
+		self.name = name
+		self.enabled = enabled
+		self.lock = Lock()
+		self.events = []
+		self.pid = os.getpid()
+		self.t0 = perf_counter()
+
+
+	# Record the duration of the enclosed code as a "complete" event.
+	# Phases are summarized by category (cat).
+	@contextmanager
+	def span(self, name, cat, **args):
+		if not self.enabled:
+			yield
+			return
+		ts = perf_counter()
+		try:
+			yield
+		finally:
+			event = {
+				'name': name,
+				'cat': cat,
+				'ph': 'X',
+				'ts': round((ts-self.t0)*1000000),
+				'dur': round((perf_counter()-ts)*1000000),
+				'pid': self.pid,
+				'tid': get_ident()
+			}
+			if args:
+				event['args'] = args
+			with self.lock:
+				self.events.append(event)
+
+
+	def get_duration(self):
+		return perf_counter()-self.t0
+
+
+	# Total time (ms) by category. Nested spans of the same category are counted once.
+	def get_summary(self):
+		res = OrderedDict()
+		with self.lock:
+			events = sorted(self.events, key=lambda e: e['ts'])
+		ends = {}
+		for e in events:
+			key = (e['cat'], e['tid'])
+			if e['ts']<ends.get(key, -1):
+				continue
+			ends[key] = e['ts']+e['dur']
+			res[e['cat']] = res.get(e['cat'], 0) + e['dur']/1000
+		return res
+
+
+	def get_summary_line(self):
+		phases = ", ".join("{}={:.0f}".format(cat, ms) for cat, ms in self.get_summary().items())
+		return "{} in {:.0f} ms: {}".format(self.name, self.get_duration()*1000, phases)
+
+
+	def save(self, fpath):
+		try:
+			os.makedirs(os.path.dirname(fpath), exist_ok=True)
+			with self.lock:
+				data = {
+					'traceEvents': list(self.events),
+					'displayTimeUnit': 'ms',
+					'otherData': { 'name': self.name }
+				}
+			with open(fpath, "w") as fh:
+				json.dump(data, fh)
+			return True
+		except Exception as e:
+			logging.error("Can't save trace '{}' => {}".format(fpath, e))
+			return False
+
+
+# Disabled trace, used as default argument
+null_trace = zynthian_trace(None, False)
+
+#------------------------------------------------------------------------------
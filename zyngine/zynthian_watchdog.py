@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+#******************************************************************************
+# ZYNTHIAN PROJECT: Zynthian Engine Watchdog (zynthian_watchdog)
+#
+# Engine health monitoring: process liveness, IPC & OSC latency, JACK ports
+#
+# Copyright (C) 2015-2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#******************************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#******************************************************************************
+
+import logging
+from time import sleep, monotonic
+from bisect import bisect_left
+from threading import Thread, Lock
+
+#------------------------------------------------------------------------------
+# Latency Histogram Class
+#------------------------------------------------------------------------------
+
+class zynthian_latency_histogram:
+
+	# Bucket upper limits (ms). Last bucket is unbounded.
+	bucket_limits = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+	def __init__(self):
+		self.lock = Lock()
+		self.reset()
+
+
+	def reset(self):
+		with self.lock:
+			self.counts = [0]*(len(self.bucket_limits)+1)
+			self.n = 0
+			self.total = 0.0
+			self.max = 0.0
+			self.last = None
+
+
+	# Add a measure, in seconds
+	def add(self, t):
+		ms = t*1000
+		i = bisect_left(self.bucket_limits, ms)
+		with self.lock:
+			self.counts[i] += 1
+			self.n += 1
+			self.total += ms
+			self.last = ms
+			if ms>self.max:
+				self.max = ms
+
+
+	def get_counts(self):
+		with self.lock:
+			return list(self.counts)
+
+
+	# Upper limit (ms) of the bucket holding the p-percentile.
+	# If "since" (a previous get_counts result) is given, only newer measures are considered.
+	def percentile(self, p, since=None):
+		counts = self.get_counts()
+		if since:
+			counts = [c-s for c,s in zip(counts,since)]
+		n = sum(counts)
+		if n==0:
+			return None
+		limit = n*p/100
+		acc = 0
+		for i, c in enumerate(counts):
+			acc += c
+			if acc>=limit:
+				if i<len(self.bucket_limits):
+					return self.bucket_limits[i]
+				else:
+					return float('inf')
+
+
+	def get_stats(self):
+		with self.lock:
+			res = {
+				'count': self.n,
+				'avg': self.total/self.n if self.n else None,
+				'max': self.max,
+				'last': self.last
+			}
+		res['p50'] = self.percentile(50)
+		res['p95'] = self.percentile(95)
+		return res
+
+#------------------------------------------------------------------------------
+# Engine Watchdog Class
+#------------------------------------------------------------------------------
+
+class zynthian_watchdog:
+
+	# Check period (seconds)
+	period = 5
+	# A command still waiting for answer this time (seconds) after the engine's proc_timeout is hung.
+	# Long commands (i.e. loading a big soundfont) are allowed up to proc_timeout.
+	ipc_hang_time = 5
+	# Max. 95-percentile latency (ms) in a check period
+	ipc_latency_max = 1000
+	osc_latency_max = 2000
+	# Max. number of automatic restarts for an engine
+	restart_max = 3
+	# Restarts count is reset after this time (seconds) without problems
+	restart_reset_time = 600
+
+	def __init__(self, zyngui, autorestart=False):
+		self.zyngui = zyngui
+		self.autorestart = autorestart
+		self.thread = None
+		self.exit_flag = False
+		self.engine_status = {}
+
+
+	def start(self):
+		if not self.thread:
+			self.exit_flag = False
+			self.thread = Thread(target=self.task, args=())
+			self.thread.daemon = True # thread dies with the program
+			self.thread.start()
+
+
+	def stop(self):
+		self.exit_flag = True
+		self.thread = None
+
+
+	def get_engines(self):
+		try:
+			return list(self.zyngui.screens['engine'].zyngines.values())
+		except:
+			return []
+
+
+	def task(self):
+		while not self.exit_flag:
+			sleep(self.period)
+			for engine in self.get_engines():
+				try:
+					self.check_engine(engine)
+				except Exception as e:
+					logging.error("Watchdog can't check engine {} => {}".format(engine.name, e))
+
+
+	def get_status(self, engine):
+		if engine not in self.engine_status:
+			self.engine_status[engine] = {
+				'ipc_counts': None,
+				'osc_counts': None,
+				'restarts': 0,
+				'problems': [],
+				'problems_ts': None,
+				'restarting': False
+			}
+		return self.engine_status[engine]
+
+
+	def check_engine(self, engine):
+		status = self.get_status(engine)
+		problems = []
+
+		# Process liveness
+		dead = engine.proc is not None and not engine.proc.isalive()
+		if dead:
+			problems.append("process is dead")
+
+		# Hung IPC command
+		hung = engine.proc_cmd_ts is not None and monotonic()-engine.proc_cmd_ts>engine.proc_timeout+self.ipc_hang_time
+		if hung:
+			problems.append("IPC command hung")
+
+		# IPC & OSC latency in the last period
+		p95 = engine.ipc_latency.percentile(95, status['ipc_counts'])
+		if p95 is not None and p95>self.ipc_latency_max:
+			problems.append("IPC latency p95 > {} ms".format(self.ipc_latency_max))
+		status['ipc_counts'] = engine.ipc_latency.get_counts()
+
+		p95 = engine.osc_latency.percentile(95, status['osc_counts'])
+		if p95 is not None and p95>self.osc_latency_max:
+			problems.append("OSC latency p95 > {} ms".format(self.osc_latency_max))
+		status['osc_counts'] = engine.osc_latency.get_counts()
+
+		# JACK ports
+		if not dead and engine.layers and engine.jackname and not engine.loading:
+			ports = self.zyngui.zynautoconnect_get_ports(engine.jackname)
+			if ports is not None and len(ports)==0:
+				problems.append("JACK ports missing")
+
+		if problems!=status['problems']:
+			if problems:
+				logging.warning("Engine {} degraded: {}".format(engine.name, ", ".join(problems)))
+			else:
+				logging.info("Engine {} recovered".format(engine.name))
+		status['problems'] = problems
+		engine.degraded = len(problems)>0
+
+		# Healthy for long enough => forget past restarts
+		if problems:
+			status['problems_ts'] = monotonic()
+		elif status['restarts']>0 and monotonic()-status['problems_ts']>self.restart_reset_time:
+			logging.info("Engine {} healthy for {} seconds. Restarts count reset.".format(engine.name, self.restart_reset_time))
+			status['restarts'] = 0
+
+		if (dead or hung) and self.autorestart and not status['restarting']:
+			if status['restarts']<self.restart_max:
+				status['restarts'] += 1
+				status['restarting'] = True
+				self.zyngui.zyncoder_thread_call(self.restart_engine, engine)
+			elif status['restarts']==self.restart_max:
+				status['restarts'] += 1
+				logging.error("Engine {} reached max. number of restarts".format(engine.name))
+
+
+	# Restart the engine and reapply the bank, preset & controller state of its layers.
+	# Run from the zyncoder thread, as the restore sends MIDI through lib_zyncoder.
+	# Serialized with snapshot loading, that could replace the engine & layers meanwhile.
+	def restart_engine(self, engine):
+		try:
+			self._restart_engine(engine)
+		finally:
+			self.get_status(engine)['restarting'] = False
+
+
+	def _restart_engine(self, engine):
+		with self.zyngui.state_lock:
+			if engine not in self.get_engines():
+				logging.info("Engine {} was stopped. Not restarting.".format(engine.name))
+				return
+			logging.warning("Watchdog restarting engine {} ...".format(engine.name))
+			layers = list(engine.layers)
+			snapshots = [layer.get_snapshot() for layer in layers]
+			for layer in layers:
+				layer.begin_restore()
+			try:
+				engine.restart()
+				for layer, snapshot in zip(layers, snapshots):
+					layer.restore_snapshot_1(snapshot)
+				for layer, snapshot in zip(layers, snapshots):
+					layer.restore_snapshot_2(snapshot)
+				self.zyngui.zynautoconnect(True)
+			except Exception as e:
+				logging.error("Watchdog can't restart engine {} => {}".format(engine.name, e))
+			finally:
+				for layer in layers:
+					layer.end_restore()
+		engine.ipc_latency.reset()
+		engine.osc_latency.reset()
+		status = self.get_status(engine)
+		status['ipc_counts'] = None
+		status['osc_counts'] = None
+
+#------------------------------------------------------------------------------
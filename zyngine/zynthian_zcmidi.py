@@ -23,6 +23,7 @@
 #******************************************************************************
 
 import logging
+import threading
 from zyncoder import *
 
 #------------------------------------------------------------------------------
@@ -37,9 +38,31 @@ class zynthian_zcmidi:
 
 	def __init__(self):
 		self.lib_zyncoder=zyncoder.get_lib_zyncoder()
+		self.deferred=threading.local()
+
+	# lib_zyncoder MIDI output is single-writer. Worker threads (i.e. concurrent snapshot restore)
+	# queue their messages, to be sent later by the calling thread.
+	def start_deferring(self):
+		self.deferred.calls=[]
+
+	def stop_deferring(self):
+		calls=getattr(self.deferred, 'calls', None)
+		self.deferred.calls=None
+		return calls or []
+
+	def send_deferred(self, calls):
+		for func, args in calls:
+			func(*args)
+
+	def send(self, func, *args):
+		calls=getattr(self.deferred, 'calls', None)
+		if calls is not None:
+			calls.append((func, args))
+		else:
+			func(*args)
 
 	def set_midi_control(self, chan, ctrl, val):
-		self.lib_zyncoder.zynmidi_send_ccontrol_change(chan, ctrl, val)
+		self.send(self.lib_zyncoder.zynmidi_send_ccontrol_change, chan, ctrl, val)
 
 	def set_midi_bank_msb(self, chan, msb):
 		logging.debug("Set MIDI CH " + str(chan) + ", Bank MSB: " + str(msb))
@@ -60,7 +83,7 @@ class zynthian_zcmidi:
 	def set_midi_prg(self, chan, prg):
 		logging.debug("Set MIDI CH " + str(chan) + ", Program: " + str(prg))
 		self.prg_selected[chan]=prg
-		self.lib_zyncoder.zynmidi_send_program_change(chan, prg)
+		self.send(self.lib_zyncoder.zynmidi_send_program_change, chan, prg)
 
 	def get_midi_prg(self, chan):
 		return self.prg_selected[chan]
@@ -72,13 +95,13 @@ class zynthian_zcmidi:
 		self.prg_selected[chan]=prg
 		self.set_midi_control(chan,0,msb)
 		self.set_midi_control(chan,32,lsb)
-		self.lib_zyncoder.zynmidi_send_program_change(chan, prg)
+		self.send(self.lib_zyncoder.zynmidi_send_program_change, chan, prg)
 
 	def get_midi_preset(self, chan):
 		return [self.bank_msb_selected[chan],self.bank_lsb_selected[chan],self.prg_selected[chan]]
 
 	def note_on(self, chan, note, vel):
-		self.lib_zyncoder.zynmidi_send_note_on(chan, note, vel)
+		self.send(self.lib_zyncoder.zynmidi_send_note_on, chan, note, vel)
 
 	def note_off(self, chan, note):
-		self.lib_zyncoder.zynmidi_send_note_on(chan, note, 0)
+		self.send(self.lib_zyncoder.zynmidi_send_note_on, chan, note, 0)
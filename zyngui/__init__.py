@@ -14,6 +14,7 @@ __all__ = [
 	"zynthian_gui_audio_out",
 	"zynthian_gui_bank",
 	"zynthian_gui_preset",
+	"zynthian_gui_preset_search",
 	"zynthian_gui_control",
 	"zynthian_gui_control_xy",
 	"zynthian_gui_midi_profile",
@@ -38,6 +39,7 @@ from zyngui.zynthian_gui_transpose import zynthian_gui_transpose
 from zyngui.zynthian_gui_audio_out import zynthian_gui_audio_out
 from zyngui.zynthian_gui_bank import zynthian_gui_bank
 from zyngui.zynthian_gui_preset import zynthian_gui_preset
+from zyngui.zynthian_gui_preset_search import zynthian_gui_preset_search
 from zyngui.zynthian_gui_control import zynthian_gui_control
 from zyngui.zynthian_gui_control_xy import zynthian_gui_control_xy
 from zyngui.zynthian_gui_midi_profile import zynthian_gui_midi_profile
@@ -274,6 +274,28 @@ force_enable_cursor=int(os.environ.get('ZYNTHIAN_UI_ENABLE_CURSOR',False))
 restore_last_state=int(os.environ.get('ZYNTHIAN_UI_RESTORE_LAST_STATE',False))
 show_cpu_status=int(os.environ.get('ZYNTHIAN_UI_SHOW_CPU_STATUS',False))
 
+#------------------------------------------------------------------------------
+# Engine Watchdog
+#------------------------------------------------------------------------------
+
+engine_watchdog=int(os.environ.get('ZYNTHIAN_UI_ENGINE_WATCHDOG',1))
+engine_watchdog_restart=int(os.environ.get('ZYNTHIAN_UI_ENGINE_WATCHDOG_RESTART',0))
+
+#------------------------------------------------------------------------------
+# Preset Prefetch
+#------------------------------------------------------------------------------
+
+preset_prefetch=int(os.environ.get('ZYNTHIAN_UI_PRESET_PREFETCH',1))
+
+#------------------------------------------------------------------------------
+# Snapshots
+#------------------------------------------------------------------------------
+
+snapshot_reconcile=int(os.environ.get('ZYNTHIAN_UI_SNAPSHOT_RECONCILE',0))
+snapshot_format=os.environ.get('ZYNTHIAN_UI_SNAPSHOT_FORMAT',"json")
+snapshot_prewarm=int(os.environ.get('ZYNTHIAN_UI_SNAPSHOT_PREWARM',0))
+snapshot_trace_dir=os.environ.get('ZYNTHIAN_UI_SNAPSHOT_TRACE_DIR',"")
+
 #------------------------------------------------------------------------------
 # MIDI Configuration
 #------------------------------------------------------------------------------
@@ -141,6 +141,9 @@ class zynthian_gui_engine(zynthian_gui_selector):
 				self.zyngines[eng]=zynthian_engine_class(info[0], info[2], self.zyngui)
 			else:
 				self.zyngines[eng]=zynthian_engine_class(self.zyngui)
+			jobs = self.zyngui.preset_search.get_engine_jobs(self.zyngines[eng])
+			if jobs:
+				self.zyngui.preset_search.start_indexing(jobs)
 
 		self.zyngine_counter+=1
 		return self.zyngines[eng]
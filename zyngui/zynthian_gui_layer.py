@@ -28,14 +28,17 @@ import os
 import sys
 import copy
 import logging
+from time import strftime
+from ctypes import c_ubyte, c_byte
 from collections import OrderedDict
-from json import JSONEncoder, JSONDecoder
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import Future
 
 # Zynthian specific modules
 from zyncoder import *
 from . import zynthian_gui_config
 from . import zynthian_gui_selector
-from zyngine import zynthian_layer
+from zyngine import zynthian_layer, zynthian_trace, null_trace, encode_snapshot, decode_snapshot, get_snapshot_writer
 
 
 #------------------------------------------------------------------------------
@@ -54,6 +57,9 @@ logging.basicConfig(stream=sys.stderr, level=zynthian_gui_config.log_level)
 
 class zynthian_gui_layer(zynthian_gui_selector):
 
+	# Engines that are always restarted when reconciling a snapshot (engine-wide config)
+	reconcile_restart_engines = ['BF']
+
 
 	def __init__(self):
 		self.layers = []
@@ -330,26 +336,60 @@ class zynthian_gui_layer(zynthian_gui_selector):
 	#----------------------------------------------------------------------------
 
 
+	# The 16x16 clone matrix & the transpose vector are moved as one buffer, if
+	# lib_zyncoder has the bulk functions. Else, one call per element is used.
+
+	def get_clone_bytes(self):
+		buf=(c_ubyte*256)()
+		try:
+			zyncoder.lib_zyncoder.get_midi_filter_clone_matrix(buf)
+		except AttributeError:
+			for i in range(0,16):
+				for j in range(0,16):
+					buf[i*16+j]=zyncoder.lib_zyncoder.get_midi_filter_clone(i,j)
+		return bytes(buf)
+
+
+	def get_clone(self):
+		data=self.get_clone_bytes()
+		return [list(data[i*16:i*16+16]) for i in range(0,16)]
+
+
 	def set_clone(self, clone_status):
-		for i in range(0,16):
-			for j in range(0,16):
-				zyncoder.lib_zyncoder.set_midi_filter_clone(i,j,clone_status[i][j])
+		buf=(c_ubyte*256)(*[int(v) for row in clone_status for v in row])
+		try:
+			zyncoder.lib_zyncoder.set_midi_filter_clone_matrix(buf)
+		except AttributeError:
+			for i in range(0,16):
+				for j in range(0,16):
+					zyncoder.lib_zyncoder.set_midi_filter_clone(i,j,buf[i*16+j])
 
 
 	def reset_clone(self):
-		for i in range(0,16):
-			for j in range(0,16):
-				zyncoder.lib_zyncoder.set_midi_filter_clone(i,j,0)
+		self.set_clone([[0]*16]*16)
+
+
+	def get_transpose(self):
+		buf=(c_byte*16)()
+		try:
+			zyncoder.lib_zyncoder.get_midi_filter_transpose_vector(buf)
+		except AttributeError:
+			for i in range(0,16):
+				buf[i]=zyncoder.lib_zyncoder.get_midi_filter_transpose(i)
+		return list(buf)
 
 
 	def set_transpose(self, transpose_status):
-		for i in range(0,16):
-			zyncoder.lib_zyncoder.set_midi_filter_transpose(i,transpose_status[i])
+		buf=(c_byte*16)(*transpose_status)
+		try:
+			zyncoder.lib_zyncoder.set_midi_filter_transpose_vector(buf)
+		except AttributeError:
+			for i in range(0,16):
+				zyncoder.lib_zyncoder.set_midi_filter_transpose(i,buf[i])
 
 
 	def reset_transpose(self):
-		for i in range(0,16):
-			zyncoder.lib_zyncoder.set_midi_filter_transpose(i,0)
+		self.set_transpose([0]*16)
 
 
 	#----------------------------------------------------------------------------
@@ -400,11 +440,11 @@ class zynthian_gui_layer(zynthian_gui_selector):
 
 
 	def get_midi_chan_zs3_used_indexes(self, midich):
-		res=[]
-		for i in range(128):
-			if self.get_midi_chan_zs3_status(midich,i):
-				res.append(i)
-		return res
+		res=set()
+		for layer in self.layers:
+			if zynthian_gui_config.midi_single_active_channel or midich==layer.get_midi_chan():
+				res.update(layer.get_zs3_used_indexes())
+		return sorted(res)
 
 
 	def midi_control_change(self, chan, ccnum, ccval):
@@ -606,8 +646,8 @@ class zynthian_gui_layer(zynthian_gui_selector):
 			snapshot={
 				'index':self.index,
 				'layers':[],
-				'clone':[],
-				'transpose':[],
+				'clone':self.get_clone(),
+				'transpose':self.get_transpose(),
 				'audio_routing': self.get_audio_routing(),
 				'extended_config': self.get_extended_config(),
 				'midi_profile_state': self.get_midi_profile_state()
@@ -615,119 +655,140 @@ class zynthian_gui_layer(zynthian_gui_selector):
 			#Layers info
 			for layer in self.layers:
 				snapshot['layers'].append(layer.get_snapshot())
-			#Clone info
-			for i in range(0,16):
-				snapshot['clone'].append([])
-				for j in range(0,16):
-					snapshot['clone'][i].append(zyncoder.lib_zyncoder.get_midi_filter_clone(i,j))
-			#Transpose info
-			for i in range(0,16):
-				snapshot['transpose'].append(zyncoder.lib_zyncoder.get_midi_filter_transpose(i))
-			#JSON Encode
-			json=JSONEncoder().encode(snapshot)
-			logging.info("Saving snapshot %s => \n%s" % (fpath,json))
+			#Encode (JSON or binary)
+			data=encode_snapshot(snapshot, zynthian_gui_config.snapshot_format)
+			logging.info("Saving snapshot %s => %d bytes" % (fpath,len(data)))
 
 		except Exception as e:
 			logging.error("Can't generate snapshot: %s" %e)
-			return False
-
-		try:
-			with open(fpath,"w") as fh:
-				fh.write(json)
-				fh.flush()
-				os.fsync(fh.fileno())
-
-		except Exception as e:
-			logging.error("Can't save snapshot '%s': %s" % (fpath,e))
-			return False
+			res=Future()
+			res.set_result(False)
+			return res
 
+		#Write in background. The returned future gives the result.
 		self.last_snapshot_fpath = fpath
-		return True
+		return get_snapshot_writer().save(fpath, data)
 
 
 	def load_snapshot(self, fpath):
-		try:
-			with open(fpath,"r") as fh:
-				json=fh.read()
-				logging.info("Loading snapshot %s => \n%s" % (fpath,json))
+		trace=zynthian_trace("Snapshot {} loaded".format(os.path.basename(fpath)))
+		with self.zyngui.state_lock:
+			res=self.load_snapshot_traced(fpath, trace)
+		logging.info(trace.get_summary_line())
+		if zynthian_gui_config.snapshot_trace_dir:
+			tname="{}-{}.json".format(strftime("%Y%m%d-%H%M%S"), os.path.splitext(os.path.basename(fpath))[0])
+			trace.save(os.path.join(zynthian_gui_config.snapshot_trace_dir, tname))
+		return res
 
-		except Exception as e:
-			logging.error("Can't load snapshot '%s': %s" % (fpath,e))
-			return False
+
+	def load_snapshot_traced(self, fpath, trace):
+		#Wait for pending snapshot writes
+		with trace.span("flush writes", "io"):
+			writer=get_snapshot_writer()
+			if not writer.flush(writer.flush_timeout):
+				logging.warning("Snapshot writes still pending after {} seconds".format(writer.flush_timeout))
+
+		#Use the prewarmed snapshot, if available
+		snapshot=None
+		if self.zyngui.snapshot_prewarm:
+			snapshot=self.zyngui.snapshot_prewarm.take(fpath)
+
+		if snapshot:
+			logging.info("Loading prewarmed snapshot %s" % fpath)
+		else:
+			try:
+				with trace.span("read", "io"):
+					with open(fpath,"rb") as fh:
+						data=fh.read()
+				logging.info("Loading snapshot %s => %d bytes" % (fpath,len(data)))
+
+			except Exception as e:
+				logging.error("Can't load snapshot '%s': %s" % (fpath,e))
+				return False
 
 		try:
-			snapshot=JSONDecoder().decode(json)
+			if not snapshot:
+				with trace.span("decode", "decode", bytes=len(data)):
+					snapshot=decode_snapshot(data)
 
-			#Clean all layers & Stop Engines
-			self.remove_all_layers(True)
+			reconcile=zynthian_gui_config.snapshot_reconcile
+			if reconcile:
+				#Reuse running engines & layers, starting/stopping only the needed ones
+				self.reconcile_layers(snapshot['layers'], trace)
 
-			#Start engines
-			for lss in snapshot['layers']:
-				engine=self.zyngui.screens['engine'].start_engine(lss['engine_nick'])
-				self.layers.append(zynthian_layer(engine,lss['midi_chan'],zynthian_gui_config.zyngui))
+			else:
+				#Clean all layers & Stop Engines
+				with trace.span("stop engines", "engine_stop"):
+					self.remove_all_layers(True)
+
+				#Start engines
+				for lss in snapshot['layers']:
+					with trace.span(lss['engine_nick'], "engine_start", midi_chan=lss['midi_chan']):
+						engine=self.zyngui.screens['engine'].start_engine(lss['engine_nick'])
+						self.layers.append(zynthian_layer(engine,lss['midi_chan'],zynthian_gui_config.zyngui))
 
 			#Remove unused engines => Trying to reuse engine instances create problems (audio routing & jack names, etc..)
 			#self.zyngui.screens['engine'].clean_unused_engines()
 
 			#Autoconnect
-			self.zyngui.zynautoconnect(True)
-
-			#Restore MIDI profile state
-			if 'midi_profile_state' in snapshot:
-				self.set_midi_profile_state(snapshot['midi_profile_state'])
+			with trace.span("autoconnect", "autoconnect"):
+				self.zyngui.zynautoconnect(True)
 
-			#Set extended config
-			if 'extended_config' in snapshot:
-				self.set_extended_config(snapshot['extended_config'])
+			with trace.span("midi config", "midi"):
+				#Restore MIDI profile state
+				if 'midi_profile_state' in snapshot:
+					if not reconcile or snapshot['midi_profile_state']!=self.get_midi_profile_state():
+						self.set_midi_profile_state(snapshot['midi_profile_state'])
+				elif reconcile:
+					self.reset_midi_profile()
 
-			# Restore layer state, step 1 => Restore Bank & Preset Status
-			i=0
-			for lss in snapshot['layers']:
-				self.layers[i].restore_snapshot_1(lss)
-				i+=1
+				#Set extended config
+				if 'extended_config' in snapshot:
+					self.set_extended_config(snapshot['extended_config'])
 
-			# Restore layer state, step 2 => Restore Controllers Status
-			i=0
-			for lss in snapshot['layers']:
-				self.layers[i].restore_snapshot_2(lss)
-				i+=1
+			# Restore layer state => Bank & Preset Status, then Controllers Status
+			self.restore_layers(snapshot['layers'], reconcile, trace)
 
 			#Fill layer list
-			self.fill_list()
+			with trace.span("layer list", "ui"):
+				self.fill_list()
 
-			#Set active layer
-			self.index=snapshot['index']
-			if self.index in self.layers:
-				self.curlayer=self.layers[self.index]
-				self.zyngui.set_curlayer(self.curlayer)
-
-			#Set Clone
-			if 'clone' in snapshot:
-				self.set_clone(snapshot['clone'])
-			else:
-				self.reset_clone()
-
-			#Set Transpose
-			if 'transpose' in snapshot:
-				self.set_transpose(snapshot['transpose'])
-			else:
-				self.reset_transpose()
+				#Set active layer
+				self.index=snapshot['index']
+				if self.index in self.layers:
+					self.curlayer=self.layers[self.index]
+					self.zyngui.set_curlayer(self.curlayer)
+
+			with trace.span("clone & transpose", "midi"):
+				#Set Clone
+				if 'clone' in snapshot:
+					self.set_clone(snapshot['clone'])
+				else:
+					self.reset_clone()
+
+				#Set Transpose
+				if 'transpose' in snapshot:
+					self.set_transpose(snapshot['transpose'])
+				else:
+					self.reset_transpose()
 
 			#Set CC-Map
 			#TODO
 
 			#Set Audio Routing
-			if 'audio_routing' in snapshot:
-				self.set_audio_routing(snapshot['audio_routing'])
-			else:
-				self.reset_audio_routing()
+			with trace.span("audio routing", "routing"):
+				if 'audio_routing' in snapshot:
+					self.set_audio_routing(snapshot['audio_routing'])
+				else:
+					self.reset_audio_routing()
 
 			#Post action
-			if self.list_data[self.index][0] in ('NEW','RESET'):
-				self.index=0
-				self.zyngui.show_screen('layer')
-			else:
-				self.select_action(self.index)
+			with trace.span("show screen", "ui"):
+				if self.list_data[self.index][0] in ('NEW','RESET'):
+					self.index=0
+					self.zyngui.show_screen('layer')
+				else:
+					self.select_action(self.index)
 
 		except Exception as e:
 			self.zyngui.reset_loading()
@@ -738,6 +799,111 @@ class zynthian_gui_layer(zynthian_gui_selector):
 		return True
 
 
+	# Restore the layers' state. Bank & preset loading runs concurrently by engine (if the engine allows it):
+	# serialized within an engine, in parallel across engines. Anything else is done from the calling thread,
+	# as lib_zyncoder's MIDI output & CC-swap functions must not be called from several threads. Every engine's
+	# layers are restored as soon as the engine is ready.
+	def restore_layers(self, lss_list, reconcile=False, trace=null_trace):
+		groups=OrderedDict()
+		for layer, lss in zip(self.layers, lss_list):
+			layer.begin_restore()
+			groups.setdefault(layer.engine, []).append((layer, lss))
+
+		try:
+			# Engines restoring from worker threads only do IPC/OSC & file loading there. Their MIDI output
+			# is deferred and, as step 2, sent from this thread. The other engines are restored inline meanwhile.
+			concurrent=[items for engine, items in groups.items() if engine.concurrent_restore]
+			inline=[items for engine, items in groups.items() if not engine.concurrent_restore]
+			if len(groups)<2:
+				inline=concurrent+inline
+				concurrent=[]
+
+			with ThreadPoolExecutor(max_workers=max(1,len(concurrent))) as executor:
+				futures={executor.submit(self.restore_engine_presets_deferred, items, reconcile, trace): items for items in concurrent}
+				for items in inline:
+					self.restore_engine_presets(items, reconcile, trace)
+					self.restore_engine_controllers(items, reconcile, trace)
+				for future in as_completed(futures):
+					self.zyngui.zynmidi.send_deferred(future.result())
+					self.restore_engine_controllers(futures[future], reconcile, trace)
+
+		finally:
+			for layer, lss in zip(self.layers, lss_list):
+				layer.end_restore()
+
+
+	# Step 1 => Restore Bank & Preset Status of an engine's layers
+	def restore_engine_presets(self, items, reconcile, trace):
+		for layer, lss in items:
+			layer.restore_snapshot_1(lss, reconcile, trace)
+
+		# Wait once for the engine, if any preset has been loaded
+		for layer, lss in items:
+			if layer.preset_loaded:
+				layer.wait_preset_settle(trace, layer.get_snapshot_settle_time())
+				break
+
+
+	# Step 1 from a worker thread. Returns the deferred MIDI output.
+	def restore_engine_presets_deferred(self, items, reconcile, trace):
+		self.zyngui.zynmidi.start_deferring()
+		try:
+			self.restore_engine_presets(items, reconcile, trace)
+		finally:
+			calls=self.zyngui.zynmidi.stop_deferring()
+		return calls
+
+
+	# Step 2 => Restore Controllers Status of an engine's layers
+	def restore_engine_controllers(self, items, reconcile, trace):
+		for layer, lss in items:
+			layer.restore_snapshot_2(lss, reconcile, trace, False)
+
+
+	# Replace the layer list by the snapshot's one, reusing running layers with the same engine
+	def reconcile_layers(self, lss_list, trace=null_trace):
+		layers=[None]*len(lss_list)
+		free_layers=[l for l in self.layers if l.engine.nickname not in self.reconcile_restart_engines]
+
+		#Reuse layers with the same engine & MIDI channel
+		for i, lss in enumerate(lss_list):
+			for layer in free_layers:
+				if layer.engine.nickname==lss['engine_nick'] and layer.midi_chan==lss['midi_chan']:
+					layers[i]=layer
+					free_layers.remove(layer)
+					break
+
+		#Reuse layers with the same engine, changing the MIDI channel
+		for i, lss in enumerate(lss_list):
+			if layers[i] is None and lss['midi_chan'] is not None:
+				for layer in free_layers:
+					if layer.engine.nickname==lss['engine_nick'] and layer.engine.options['midi_chan'] and layer.midi_chan is not None:
+						layer.set_midi_chan(lss['midi_chan'])
+						layers[i]=layer
+						free_layers.remove(layer)
+						break
+
+		#Remove the other layers & stop unused engines
+		with trace.span("stop engines", "engine_stop"):
+			for layer in list(self.layers):
+				if layer not in layers:
+					self.remove_layer(self.layers.index(layer), False)
+			self.zyngui.screens['engine'].clean_unused_engines()
+
+		#Start engines & create layers not found
+		n_reused=0
+		for i, lss in enumerate(lss_list):
+			if layers[i] is None:
+				with trace.span(lss['engine_nick'], "engine_start", midi_chan=lss['midi_chan']):
+					engine=self.zyngui.screens['engine'].start_engine(lss['engine_nick'])
+					layers[i]=zynthian_layer(engine,lss['midi_chan'],zynthian_gui_config.zyngui)
+			else:
+				n_reused+=1
+
+		self.layers=layers
+		logging.info("Snapshot reconciled: {} layers reused, {} created".format(n_reused, len(layers)-n_reused))
+
+
 	def get_midi_profile_state(self):
 		# Get MIDI profile state from environment
 		midi_profile_state = OrderedDict()
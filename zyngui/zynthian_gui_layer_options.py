@@ -109,6 +109,9 @@ class zynthian_gui_layer_options(zynthian_gui_selector):
 			if eng_options['midi_chan']:
 				self.list_data.append((self.layer_midi_chan, None, "MIDI Channel"))
 
+			if self.layer.preset_name or self.layer.bank_name:
+				self.list_data.append((self.layer_search_similar, None, "Search Similar Presets"))
+
 			self.list_data.append((self.layer_remove, None, "Remove Layer"))
 
 			# Add separator
@@ -218,6 +221,13 @@ class zynthian_gui_layer_options(zynthian_gui_selector):
 		self.zyngui.show_modal('transpose')
 
 
+	# Search presets named like the layer's preset (or bank)
+	def layer_search_similar(self):
+		self.zyngui.set_curlayer(self.layer)
+		self.zyngui.screens['preset_search'].search(self.layer.preset_name or self.layer.bank_name)
+		self.zyngui.show_screen('preset_search')
+
+
 	def layer_audio_routing(self):
 		self.zyngui.screens['audio_out'].set_layer(self.layer)
 		self.zyngui.show_modal('audio_out')
@@ -24,7 +24,9 @@
 #******************************************************************************
 
 import sys
+import tkinter
 import logging
+from time import monotonic
 
 # Zynthian specific modules
 from . import zynthian_gui_config
@@ -43,14 +45,53 @@ logging.basicConfig(stream=sys.stderr, level=zynthian_gui_config.log_level)
 
 class zynthian_gui_preset(zynthian_gui_selector):
 
+	# Max. time (seconds) adding presets to the list on each UI loop, when filled incrementally
+	fill_slice_time = 0.05
+
 	def __init__(self):
 		super().__init__('Preset', True)
       
       
 	def fill_list(self):
-		self.zyngui.curlayer.load_preset_list()
-		self.list_data=self.zyngui.curlayer.preset_list
-		super().fill_list()
+		layer=self.zyngui.curlayer
+		presets=None
+		if layer.bank_info:
+			presets=layer.engine.get_preset_list_iter(layer.bank_info)
+		if presets is None:
+			layer.load_preset_list()
+			self.list_data=layer.preset_list
+			super().fill_list()
+		else:
+			# Slow preset lists are shown while they are being filled
+			old_preset_list=layer.preset_list
+			self.list_data=[]
+			layer.preset_list=self.list_data
+			layer.reset_list_index_of(old_preset_list)
+			super().fill_list()
+			self.fill_list_slice(layer, self.list_data, presets)
+
+
+	# Filling goes on while the layer has this list, even if not shown anymore, so it's not left partial
+	def fill_list_slice(self, layer, preset_list, presets):
+		if layer.preset_list is not preset_list:
+			return
+		shown=preset_list is self.list_data
+		ts=monotonic()
+		done=True
+		for preset in presets:
+			preset_list.append(preset)
+			if shown:
+				self.listbox.insert(tkinter.END, preset[2])
+			if monotonic()-ts>self.fill_slice_time:
+				done=False
+				break
+		if done:
+			layer.set_preset_list(preset_list)
+		else:
+			zynthian_gui_config.top.after(1, self.fill_list_slice, layer, preset_list, presets)
+		if shown:
+			self.select()
+			self.set_selector()
 
 
 	def show(self):
@@ -58,6 +99,19 @@ class zynthian_gui_preset(zynthian_gui_selector):
 		super().show()
 
 
+	def hide(self):
+		if self.zyngui.preset_prefetch:
+			self.zyngui.preset_prefetch.cancel()
+		super().hide()
+
+
+	def select_listbox(self, index):
+		super().select_listbox(index)
+		# Warm up the presets around the cursor, so note-on preload is fast
+		if zynthian_gui_config.preset_preload_noteon and self.zyngui.preset_prefetch and self.zyngui.curlayer:
+			self.zyngui.preset_prefetch.request(self.zyngui.curlayer.engine, self.list_data, self.index)
+
+
 	def select_action(self, i, t='S'):
 		self.zyngui.curlayer.set_preset(i)
 		self.zyngui.show_screen('control')
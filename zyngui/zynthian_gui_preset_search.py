@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#******************************************************************************
+# ZYNTHIAN PROJECT: Zynthian GUI
+#
+# Zynthian GUI Preset Search Results Class
+#
+# Copyright (C) 2015-2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#******************************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#******************************************************************************
+
+import sys
+import logging
+
+# Zynthian specific modules
+from . import zynthian_gui_config
+from . import zynthian_gui_selector
+
+#------------------------------------------------------------------------------
+# Configure logging
+#------------------------------------------------------------------------------
+
+# Set root logging level
+logging.basicConfig(stream=sys.stderr, level=zynthian_gui_config.log_level)
+
+#-------------------------------------------------------------------------------
+# Zynthian Preset Search Results GUI Class
+#-------------------------------------------------------------------------------
+
+class zynthian_gui_preset_search(zynthian_gui_selector):
+
+	def __init__(self):
+		self.query = ""
+		super().__init__('Search', True)
+
+
+	def search(self, query):
+		self.query = query
+		self.index = 0
+		self.fill_list()
+
+
+	def fill_list(self):
+		self.list_data=[]
+		for res in self.zyngui.preset_search.search(self.query):
+			score, engine_nick, bank_name, preset_name = res
+			if preset_name is None:
+				title = "{} [{}]".format(bank_name, engine_nick)
+			else:
+				title = "{} - {} [{}]".format(preset_name, bank_name, engine_nick)
+			self.list_data.append((res,len(self.list_data),title))
+		super().fill_list()
+
+
+	# Find a layer running the result's engine, preferring the current one
+	def get_result_layer(self, engine_nick):
+		if self.zyngui.curlayer and self.zyngui.curlayer.engine.nickname==engine_nick:
+			return self.zyngui.curlayer
+		for layer in self.zyngui.screens['layer'].layers:
+			if layer.engine.nickname==engine_nick:
+				return layer
+
+
+	def select_action(self, i, t='S'):
+		score, engine_nick, bank_name, preset_name = self.list_data[i][0]
+		layer = self.get_result_layer(engine_nick)
+		if layer is None:
+			logging.warning("No layer for engine {}".format(engine_nick))
+			return
+
+		layer.load_bank_list()
+		if not layer.set_bank_by_name(bank_name):
+			logging.warning("Bank '{}' not found".format(bank_name))
+			return
+		layer.load_preset_list()
+
+		self.zyngui.set_curlayer(layer)
+		if preset_name is None:
+			self.zyngui.show_screen('preset')
+		elif layer.set_preset_by_name(preset_name):
+			self.zyngui.show_screen('control')
+		else:
+			logging.warning("Preset '{}' not found".format(preset_name))
+
+
+	def set_select_path(self):
+		self.select_path.set("Search: {}".format(self.query))
+
+#------------------------------------------------------------------------------
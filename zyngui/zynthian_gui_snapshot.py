@@ -26,9 +26,11 @@
 import os
 import sys
 import logging
+from time import monotonic
 from os.path import isfile, isdir, join, basename
 
 # Zynthian specific modules
+from zyngine import get_preset_catalog
 from . import zynthian_gui_config
 from . import zynthian_gui_selector
 
@@ -45,6 +47,9 @@ logging.basicConfig(stream=sys.stderr, level=zynthian_gui_config.log_level)
 
 class zynthian_gui_snapshot(zynthian_gui_selector):
 
+	# Time (seconds) the in-memory snapshot index is trusted without checking the mtimes
+	index_ttl = 5
+
 	def __init__(self):
 		self.base_dir = os.environ.get('ZYNTHIAN_MY_DATA_DIR',"/zynthian/zynthian-my-data") + "/snapshots"
 		self.default_snapshot_fpath = join(self.base_dir,"default.zss")
@@ -53,7 +58,12 @@ class zynthian_gui_snapshot(zynthian_gui_selector):
 		self.bankless_mode = False
 		self.action = "LOAD"
 		self.index_offset = 0
+		self.snapshot_index = None
+		self.snapshot_index_sig = None
+		self.snapshot_index_ts = 0
+		# MIDI bank number => bank dir
 		self.midi_banks = {}
+		# bank dir => MIDI program number => snapshot path
 		self.midi_programs = {}
 		super().__init__('Bank', True)
 
@@ -82,14 +92,102 @@ class zynthian_gui_snapshot(zynthian_gui_selector):
 			self.index=0
 
 
+	#----------------------------------------------------------------------------
+	# Snapshot Index
+	#----------------------------------------------------------------------------
+
+	def get_midi_number_or_none(self, f):
+		try:
+			return self.get_midi_number(f)
+		except:
+			return None
+
+
+	# Index of snapshot banks & programs: {default, last_state, banks: [[dir, bn], ...], snapshots: {dir: [[fname, title, pn], ...]}}
+	def scan_snapshot_index(self):
+		index = {
+			'default': isfile(self.default_snapshot_fpath),
+			'last_state': isfile(self.last_state_snapshot_fpath),
+			'banks': [],
+			'snapshots': {}
+		}
+		for d in sorted(os.listdir(self.base_dir)):
+			dpath = join(self.base_dir,d)
+			if isdir(dpath):
+				index['banks'].append([d, self.get_midi_number_or_none(d)])
+				snapshots = index['snapshots'][d] = []
+				for f in sorted(os.listdir(dpath)):
+					if f[-4:].lower()=='.zss' and isfile(join(dpath,f)):
+						title = f[:-4]
+						snapshots.append([f, title, self.get_midi_number_or_none(title)])
+		return index
+
+
+	# Adding/removing files changes the mtime of the containing dir
+	def get_snapshot_index_deps(self, index):
+		return [self.base_dir] + [join(self.base_dir,b[0]) for b in index['banks']]
+
+
+	def load_snapshot_index(self):
+		catalog = get_preset_catalog()
+		index = catalog.get('snapshots', self.base_dir)
+		if index is None:
+			index = self.scan_snapshot_index()
+			catalog.put('snapshots', self.base_dir, index, self.get_snapshot_index_deps(index))
+		return index
+
+
+	# In-memory index. It's validated against the dir mtimes when "validate" is set or index_ttl has elapsed.
+	def get_snapshot_index(self, validate=False):
+		if self.snapshot_index is not None:
+			if not validate and monotonic()-self.snapshot_index_ts<self.index_ttl:
+				return self.snapshot_index
+			if get_preset_catalog().get_deps_signature(self.get_snapshot_index_deps(self.snapshot_index))==self.snapshot_index_sig:
+				self.snapshot_index_ts = monotonic()
+				return self.snapshot_index
+
+		index = self.load_snapshot_index()
+		self.snapshot_index = index
+		self.snapshot_index_sig = get_preset_catalog().get_deps_signature(self.get_snapshot_index_deps(index))
+		self.snapshot_index_ts = monotonic()
+		self.build_midi_maps()
+		return index
+
+
+	def invalidate_snapshot_index(self, *args):
+		self.snapshot_index_ts = 0
+
+
+	def build_midi_maps(self):
+		self.midi_banks = {}
+		self.midi_programs = {}
+		for bname, bn in self.snapshot_index['banks']:
+			if bn is not None:
+				self.midi_banks[str(bn)] = bname
+				logging.debug("Snapshot Bank '%s' => MIDI bank %d" % (bname,bn))
+			else:
+				logging.warning("Snapshot Bank '%s' don't have a MIDI bank number" % bname)
+			programs = self.midi_programs[bname] = {}
+			for f, title, pn in self.snapshot_index['snapshots'][bname]:
+				if pn is not None and bn is not None:
+					programs[str(pn)] = join(self.base_dir,bname,f)
+					logging.debug("Snapshot '{}' => MIDI bank {}, program {}".format(title,bn,pn))
+				else:
+					logging.warning("Snapshot '{}' don't have a MIDI program number".format(title))
+
+	#----------------------------------------------------------------------------
+	# Snapshot Lists
+	#----------------------------------------------------------------------------
+
 	def check_bankless_mode(self):
-		banks = [ d for d in os.listdir(self.base_dir) if os.path.isdir(os.path.join(self.base_dir, d)) ]
+		banks = [b[0] for b in self.get_snapshot_index(True)['banks']]
 		n_banks = len(banks)
 
 		# If no banks, create the first one and choose it.
 		if n_banks == 0:
 			self.bank_dir = "000"
 			os.makedirs(self.base_dir + "/" + self.bank_dir)
+			self.invalidate_snapshot_index()
 			self.bankless_mode = True
 
 		# If only one bank, choose it.
@@ -103,15 +201,15 @@ class zynthian_gui_snapshot(zynthian_gui_selector):
 
 
 	def load_bank_list(self):
-		self.midi_banks={}
+		index=self.get_snapshot_index()
 		self.list_data=[]
 
 		i=0
-		if self.action=="SAVE" or isfile(self.default_snapshot_fpath):
+		if self.action=="SAVE" or index['default']:
 			self.list_data.append((self.default_snapshot_fpath,i,"Default"))
 			i=i+1
 
-		if self.action=="LOAD" and isfile(self.last_state_snapshot_fpath):
+		if self.action=="LOAD" and index['last_state']:
 			self.list_data.append((self.last_state_snapshot_fpath,i,"Last State"))
 			i += 1
 
@@ -121,21 +219,13 @@ class zynthian_gui_snapshot(zynthian_gui_selector):
 
 		self.change_index_offset(i)
 
-		for f in sorted(os.listdir(self.base_dir)):
-			dpath=join(self.base_dir,f)
-			if isdir(dpath):
-				self.list_data.append((dpath,i,f))
-				try:
-					bn=self.get_midi_number(f)
-					self.midi_banks[str(bn)]=i
-					logging.debug("Snapshot Bank '%s' => MIDI bank %d" % (f,bn))
-				except:
-					logging.warning("Snapshot Bank '%s' don't have a MIDI bank number" % f)
-				i=i+1
+		for f, bn in index['banks']:
+			self.list_data.append((join(self.base_dir,f),i,f))
+			i=i+1
 
 
 	def load_snapshot_list(self):
-		self.midi_programs={}
+		index=self.get_snapshot_index()
 		self.list_data = []
 
 		i = 0
@@ -144,11 +234,11 @@ class zynthian_gui_snapshot(zynthian_gui_selector):
 			i += 1
 
 		else:
-			if self.action=="SAVE" or isfile(self.default_snapshot_fpath):
+			if self.action=="SAVE" or index['default']:
 				self.list_data.append((self.default_snapshot_fpath,i,"Default"))
 				i += 1
 
-			if self.action=="LOAD" and isfile(self.last_state_snapshot_fpath):
+			if self.action=="LOAD" and index['last_state']:
 				self.list_data.append((self.last_state_snapshot_fpath,i,"Last State"))
 				i += 1
 
@@ -158,21 +248,9 @@ class zynthian_gui_snapshot(zynthian_gui_selector):
 
 		self.change_index_offset(i)
 
-		head, bname = os.path.split(self.bank_dir)
-		for f in sorted(os.listdir(join(self.base_dir,self.bank_dir))):
-			fpath=self.get_snapshot_fpath(f)
-			if isfile(fpath) and f[-4:].lower()=='.zss':
-				#title=str.replace(f[:-4], '_', ' ')
-				title=f[:-4]
-				self.list_data.append((fpath,i,title))
-				try:
-					bn=self.get_midi_number(bname)
-					pn=self.get_midi_number(title)
-					self.midi_programs[str(pn)]=i
-					logging.debug("Snapshot '{}' => MIDI bank {}, program {}".format(title,bn,pn))
-				except:
-					logging.warning("Snapshot '{}' don't have a MIDI program number".format(title))
-				i += 1
+		for f, title, pn in index['snapshots'].get(self.bank_dir, []):
+			self.list_data.append((self.get_snapshot_fpath(f),i,title))
+			i += 1
 
 
 	def fill_list(self):
@@ -236,31 +314,39 @@ class zynthian_gui_snapshot(zynthian_gui_selector):
 		elif self.action=="SAVE":
 			if fpath=='NEW_SNAPSHOT':
 				fpath=self.get_snapshot_fpath(self.get_new_snapshot())
-				self.zyngui.screens['layer'].save_snapshot(fpath)
+				self.save_snapshot(fpath)
 				self.zyngui.show_active_screen()
 			else:
 				if isfile(fpath):
 					self.zyngui.show_confirm("Do you really want to overwrite the snapshot %s?" % fname, self.cb_confirm_save_snapshot,[fpath])
 				else:
-					self.zyngui.screens['layer'].save_snapshot(fpath)
+					self.save_snapshot(fpath)
 					self.zyngui.show_active_screen()
 
 
+	# The index is checked again when the snapshot file is written
+	def save_snapshot(self, fpath):
+		future=self.zyngui.screens['layer'].save_snapshot(fpath)
+		future.add_done_callback(self.invalidate_snapshot_index)
+		return future
+
+
 	def cb_confirm_save_snapshot(self, params):
-		self.zyngui.screens['layer'].save_snapshot(params[0])
+		self.save_snapshot(params[0])
 
 
 	def save_default_snapshot(self):
-		self.zyngui.screens['layer'].save_snapshot(self.default_snapshot_fpath)
+		self.save_snapshot(self.default_snapshot_fpath)
 
 
 	def save_last_state_snapshot(self):
-		self.zyngui.screens['layer'].save_snapshot(self.last_state_snapshot_fpath)
+		self.save_snapshot(self.last_state_snapshot_fpath)
 
 
 	def delete_last_state_snapshot(self):
 		try:
 			os.remove(self.last_state_snapshot_fpath)
+			self.invalidate_snapshot_index()
 		except:
 			pass
 
@@ -270,22 +356,27 @@ class zynthian_gui_snapshot(zynthian_gui_selector):
 
 
 	def midi_bank_change(self, bn):
-		#Get bank list
-		old_bank_dir=self.bank_dir
-		self.bank_dir=None
-		self.fill_list()
+		self.get_snapshot_index()
 		#Load bank dir
 		bn=str(bn)
 		if bn in self.midi_banks:
-			self.bank_dir=self.list_data[self.midi_banks[bn]][2]
+			self.bank_dir=self.midi_banks[bn]
 			logging.debug("Snapshot Bank Change %s: %s" % (bn,self.bank_dir))
 			self.show()
+			self.prewarm_bank(self.bank_dir)
 			return True
 		else:
-			self.bank_dir=old_bank_dir
 			return False
 
 
+	# Parse the bank's snapshots & read-ahead their preset files in background
+	def prewarm_bank(self, bank_dir):
+		if self.zyngui.snapshot_prewarm:
+			fpaths=[join(self.base_dir,bank_dir,s[0]) for s in self.get_snapshot_index()['snapshots'].get(bank_dir, [])]
+			engine_classes={nick: info[3] for nick, info in self.zyngui.screens['engine'].engine_info.items()}
+			self.zyngui.snapshot_prewarm.request(fpaths, engine_classes)
+
+
 	def midi_bank_change_offset(self,offset):
 		try:
 			bn = self.get_midi_number(self.bank_dir)+offset
@@ -303,15 +394,17 @@ class zynthian_gui_snapshot(zynthian_gui_selector):
 
 
 	def midi_program_change(self, pn):
+		index=self.get_snapshot_index()
 		#If no bank selected, default to first bank
 		if self.bank_dir is None:
-			self.fill_list()
-			self.bank_dir=self.list_data[0][2]
-			self.fill_list()
+			if not index['banks']:
+				return False
+			self.bank_dir=index['banks'][0][0]
 		#Load snapshot
 		pn=str(pn)
-		if pn in self.midi_programs:
-			fpath=self.list_data[self.midi_programs[pn]][0]
+		programs=self.midi_programs.get(self.bank_dir, {})
+		if pn in programs:
+			fpath=programs[pn]
 			logging.debug("Snapshot Program Change %s: %s" % (pn,fpath))
 			self.zyngui.screens['layer'].load_snapshot(fpath)
 			return True
@@ -36,6 +36,7 @@ from time import sleep
 from os.path import isfile
 from datetime import datetime
 from threading  import Thread
+from collections import deque
 from subprocess import check_output
 from ctypes import c_float
 
@@ -48,6 +49,11 @@ from zyncoder import *
 from zyncoder.zyncoder import lib_zyncoder, lib_zyncoder_init
 from zyngine import zynthian_zcmidi
 from zyngine import zynthian_midi_filter
+from zyngine import zynthian_watchdog
+from zyngine import zynthian_preset_prefetch
+from zyngine import zynthian_snapshot_prewarm
+from zyngine import get_preset_search
+from zyngine import get_snapshot_writer
 from zyngui import zynthian_gui_config
 from zyngui.zynthian_gui_controller import zynthian_gui_controller
 from zyngui.zynthian_gui_selector import zynthian_gui_selector
@@ -62,6 +68,7 @@ from zyngui.zynthian_gui_transpose import zynthian_gui_transpose
 from zyngui.zynthian_gui_audio_out import zynthian_gui_audio_out
 from zyngui.zynthian_gui_bank import zynthian_gui_bank
 from zyngui.zynthian_gui_preset import zynthian_gui_preset
+from zyngui.zynthian_gui_preset_search import zynthian_gui_preset_search
 from zyngui.zynthian_gui_control import zynthian_gui_control
 from zyngui.zynthian_gui_control_xy import zynthian_gui_control_xy
 from zyngui.zynthian_gui_midi_profile import zynthian_gui_midi_profile
@@ -139,10 +146,18 @@ class zynthian_gui:
 		self.polling = False
 
 		self.loading = 0
+		self.loading_lock = threading.Lock()
+		# Serializes snapshot loading & watchdog engine restarts
+		self.state_lock = threading.RLock()
 		self.loading_thread = None
 		self.zyncoder_thread = None
+		self.watchdog = None
+		self.preset_prefetch = None
+		self.snapshot_prewarm = None
+		self.preset_search = get_preset_search()
 		self.zynread_wait_flag = False
 		self.zynswitch_defered_event = None
+		self.zyncoder_thread_calls = deque()
 		self.exit_flag = False
 		self.exit_code = 0
 
@@ -256,6 +271,8 @@ class zynthian_gui:
 		parts = path.split("/", 2)
 		if parts[0]=="" and parts[1].upper()=="CUIA":
 			self.callable_ui_action(parts[2].upper(), args)
+		elif parts[0]=="" and parts[1].upper()=="SEARCH":
+			self.osc_search(parts[2].upper(), args, src)
 		else:
 			logging.warning("Not supported OSC call '{}'".format(path))
 
@@ -263,6 +280,17 @@ class zynthian_gui:
 		#	logging.debug("argument of type '%s': %s" % (t, a))
 
 
+	# Reply with one "/SEARCH/RESULT" message for each match, ending with "/SEARCH/END"
+	def osc_search(self, what, args, src):
+		if what=="PRESET" and len(args)>0:
+			for i, res in enumerate(self.preset_search.search(str(args[0]))):
+				score, engine_nick, bank_name, preset_name = res
+				liblo.send(src, "/SEARCH/RESULT", i, engine_nick, bank_name, preset_name or "", score)
+			liblo.send(src, "/SEARCH/END")
+		else:
+			logging.warning("Not supported OSC search '{}'".format(what))
+
+
 	# ---------------------------------------------------------------------------
 	# GUI Core Management
 	# ---------------------------------------------------------------------------
@@ -281,6 +309,7 @@ class zynthian_gui:
 		self.screens['audio_out']=zynthian_gui_audio_out()
 		self.screens['bank']=zynthian_gui_bank()
 		self.screens['preset']=zynthian_gui_preset()
+		self.screens['preset_search']=zynthian_gui_preset_search()
 		self.screens['control']=zynthian_gui_control()
 		self.screens['control_xy']=zynthian_gui_control_xy()
 		self.screens['midi_profile']=zynthian_gui_midi_profile()
@@ -320,14 +349,33 @@ class zynthian_gui:
 			# Show "load snapshot" popup. Autoclose if no snapshots available ...
 			self.load_snapshot(autoclose=True)
 
+		# Build preset search index for engines not needing a running instance
+		self.start_preset_search_index()
+
 		# Start polling threads
 		self.start_polling()
 		self.start_loading_thread()
 		self.start_zyncoder_thread()
+		self.start_watchdog()
+		self.start_preset_prefetch()
+		self.start_snapshot_prewarm()
+
+
+	def start_preset_search_index(self):
+		jobs=[]
+		self.screens['engine'].init_engine_info()
+		for eng, info in self.screens['engine'].engine_info.items():
+			if not eng.startswith("JV/"):
+				jobs.append((self.preset_search.index_engine_class, (eng, info[3])))
+		self.preset_search.start_indexing(jobs)
 
 
 	def stop(self):
 		logging.info("STOPPING ZYNTHIAN-UI ...")
+		self.stop_watchdog()
+		self.stop_preset_prefetch()
+		self.stop_snapshot_prewarm()
+		get_snapshot_writer().stop()
 		self.stop_polling()
 		self.osc_end()
 		zynautoconnect.stop()
@@ -560,6 +608,13 @@ class zynthian_gui:
 			except:
 				pass
 
+		elif cuia == "SEARCH_PRESET":
+			try:
+				self.screens['preset_search'].search(str(params[0]))
+				self.show_screen('preset_search')
+			except Exception as e:
+				logging.error("Can't search presets => {}".format(e))
+
 		elif cuia == "SWITCH_LAYER_SHORT":
 			self.zynswitch_short(0)
 
@@ -935,6 +990,28 @@ class zynthian_gui:
 				self.zynswitch_Y(event[1])
 
 
+	#------------------------------------------------------------------
+	# Zyncoder Thread Calls
+	#------------------------------------------------------------------
+
+
+	# Run a function from the zyncoder thread, that owns lib_zyncoder's MIDI I/O
+	def zyncoder_thread_call(self, func, *args):
+		if self.zyncoder_thread:
+			self.zyncoder_thread_calls.append((func, args))
+		else:
+			func(*args)
+
+
+	def zyncoder_thread_calls_exec(self):
+		while self.zyncoder_thread_calls:
+			func, args = self.zyncoder_thread_calls.popleft()
+			try:
+				func(*args)
+			except Exception as err:
+				logging.exception(err)
+
+
 	#------------------------------------------------------------------
 	# Threads
 	#------------------------------------------------------------------
@@ -951,6 +1028,7 @@ class zynthian_gui:
 		while not self.exit_flag:
 			self.zyncoder_read()
 			self.zynmidi_read()
+			self.zyncoder_thread_calls_exec()
 			self.osc_receive()
 			sleep(0.04)
 			if self.zynread_wait_flag:
@@ -1108,20 +1186,60 @@ class zynthian_gui:
 		self.loading_thread.start()
 
 
+	def start_watchdog(self):
+		if zynthian_gui_config.engine_watchdog:
+			self.watchdog=zynthian_watchdog(self, zynthian_gui_config.engine_watchdog_restart)
+			self.watchdog.start()
+
+
+	def stop_watchdog(self):
+		if self.watchdog:
+			self.watchdog.stop()
+			self.watchdog=None
+
+
+	def start_preset_prefetch(self):
+		if zynthian_gui_config.preset_prefetch:
+			self.preset_prefetch=zynthian_preset_prefetch()
+			self.preset_prefetch.start()
+
+
+	def stop_preset_prefetch(self):
+		if self.preset_prefetch:
+			self.preset_prefetch.stop()
+			self.preset_prefetch=None
+
+
+	def start_snapshot_prewarm(self):
+		if zynthian_gui_config.snapshot_prewarm:
+			self.snapshot_prewarm=zynthian_snapshot_prewarm()
+			self.snapshot_prewarm.start()
+
+
+	def stop_snapshot_prewarm(self):
+		if self.snapshot_prewarm:
+			self.snapshot_prewarm.stop()
+			self.snapshot_prewarm=None
+
+
+	# Engines may start/stop loading from several threads (i.e. concurrent snapshot restore)
 	def start_loading(self):
-		self.loading=self.loading+1
-		if self.loading<1: self.loading=1
+		with self.loading_lock:
+			self.loading=self.loading+1
+			if self.loading<1: self.loading=1
 		#logging.debug("START LOADING %d" % self.loading)
 
 
 	def stop_loading(self):
-		self.loading=self.loading-1
-		if self.loading<0: self.loading=0
+		with self.loading_lock:
+			self.loading=self.loading-1
+			if self.loading<0: self.loading=0
 		#logging.debug("STOP LOADING %d" % self.loading)
 
 
 	def reset_loading(self):
-		self.loading=0
+		with self.loading_lock:
+			self.loading=0
 
 
 	def loading_refresh(self):
@@ -1357,6 +1475,10 @@ class zynthian_gui:
 		zynautoconnect.audio_autoconnect(force)
 
 
+	def zynautoconnect_get_ports(self, client_name):
+		return zynautoconnect.get_client_ports(client_name)
+
+
 	def zynautoconnect_acquire_lock(self):
 		#Get Mutex Lock
 		zynautoconnect.acquire_lock()